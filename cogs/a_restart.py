@@ -5,7 +5,10 @@ import subprocess
 from discord.ext import commands
 
 import utils.checks as checks
+from utils.blacklists import flush_all_sync
 from utils.dataIOa import dataIOa
+from utils.executors import shutdown_pools
+from utils.http import http
 
 
 class ARestart(commands.Cog):
@@ -49,6 +52,12 @@ class ARestart(commands.Cog):
                 t.cancel()
             except:
                 pass
+        if hasattr(self.bot, 'log_sink'):
+            await self.bot.log_sink.close()
+        await http.close()
+        shutdown_pools(wait=False)
+        dataIOa.flush()
+        flush_all_sync()
         os._exit(0)
 
 
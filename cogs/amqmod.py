@@ -9,7 +9,6 @@ import re
 import subprocess
 import traceback
 
-import aiohttp
 import discord
 import requests
 from discord import Embed
@@ -25,6 +24,8 @@ from selenium.webdriver import ActionChains
 import utils.checks as checks
 import utils.discordUtils as dutils
 from utils.dataIOa import dataIOa
+from utils.executors import get_pool
+from utils.http import http
 from models.partyranks import PRMembers, PRManager
 
 logger = logging.getLogger('info')
@@ -512,17 +513,16 @@ return ret_7
         off = 0
         ret = ""
         while True:
-            async with aiohttp.ClientSession() as session:
-                await asyncio.sleep(0.5)
-                async with session.get(
-                        f"https://myanimelist.net/animelist/{username}/load.json?offset={off}&status=7") as r:
-                    a = await r.text()
-                    if a == '[]':
-                        return ret
-                    # return await r.text()
-                    d = 0
-                    ret += a
-                    off += 300
+            await asyncio.sleep(0.5)
+            async with http.get(
+                    f"https://myanimelist.net/animelist/{username}/load.json?offset={off}&status=7") as r:
+                a = await r.text()
+                if a == '[]':
+                    return ret
+                # return await r.text()
+                d = 0
+                ret += a
+                off += 300
         # return ret
 
     async def upload_file_to_catbox(self, file, ctx):
@@ -546,8 +546,7 @@ return ret_7
         # await ctx.send(f"Uploading **{origname}**")
 
         try:
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(None, self.do_request, payload, files)
+            response = await get_pool('network').run(self.do_request, payload, files)
             was_ok = True
             if response.ok:
                 await ctx.send(f"✅ {origname}: " + f'<{response.text}>')
@@ -571,21 +570,20 @@ return ret_7
     @staticmethod
     async def is_catbox_alive():
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get("https://catbox.moe/", headers={'user-agent': '"Mozilla/5.0 '
-                                                                                     '(Windows NT 6.1; WOW64; '
-                                                                                     'Trident/7.0; '
-                                                                                     'rv:11.0) like Gecko"'}) as r:
-                    if r.status == 200:
-                        return True
-                    else:
-                        print('--Catbox not alive?')
-                        print(r.status)
-                        print('--Content:\n')
-                        print(r.content)
-                        print('--Reson:\n')
-                        print(r.reason)
-                        return False
+            async with http.get("https://catbox.moe/", headers={'user-agent': '"Mozilla/5.0 '
+                                                                              '(Windows NT 6.1; WOW64; '
+                                                                              'Trident/7.0; '
+                                                                              'rv:11.0) like Gecko"'}) as r:
+                if r.status == 200:
+                    return True
+                else:
+                    print('--Catbox not alive?')
+                    print(r.status)
+                    print('--Content:\n')
+                    print(r.content)
+                    print('--Reson:\n')
+                    print(r.reason)
+                    return False
         except:
             print('--Catbox not alive??')
             import ssl
@@ -1029,7 +1027,6 @@ return ret_7
             upl = data.pop()
             if int(upl["annID"]) in self.ignored_ann_ids:
                 continue
-            loop = asyncio.get_event_loop()
             ll = 'link_7'
             if 'link_4' in upl:
                 ll = 'link_4'
@@ -1045,19 +1042,17 @@ return ret_7
                 # fil = upl[ll]  # better safe than sorry zzzzzzzzzzzzzz
                 # panic for no log basically | info
                 LOGLEVEL = "panic"
-                process = subprocess.Popen(
+                await get_pool('transcode').run_process(
                     ["ffmpeg", "-hide_banner", "-loglevel", LOGLEVEL, "-i", fil,
                      "-b:a", "320k",
                      "-ac", "2", "-map", "a:0", out, "-y"],
                     stdout=subprocess.PIPE)
-                await loop.run_in_executor(None, process.communicate)
                 await asyncio.sleep(0.1)
                 if not os.path.exists(out):
-                    process = subprocess.Popen(
+                    await get_pool('transcode').run_process(
                         ["ffmpeg", "-hide_banner", "-loglevel", LOGLEVEL, "-i", fil, "-b:a", "320k",
                          "-ac", "2", "-map", "a:0", out, "-y"],
                         stdout=subprocess.PIPE)
-                    await loop.run_in_executor(None, process.communicate)
                     await asyncio.sleep(0.1)
 
             feedback = True
@@ -249,13 +249,13 @@ class Cmds(commands.Cog):
                     icmds_by_g[v['guild_id']].append(
                         f'**{k}** (raw)' if v['raw'] else f'**{k}** (image)' if v['image'] else f'**{k}** (txt)'
                     )
-                    if k in self.bot.all_cmds[ctx.guild.id]['cmds_name_list']:
+                    if k in self.bot.all_cmds[ctx.guild.id]['cmds']:
                         icmds_by_g[v['guild_id']][-1] = f"~~{icmds_by_g[v['guild_id']][-1]}~~"
             for k, v in icmds_by_g.items():
                 icmds_by_g[k] = dutils.getParts2kByDelimiter("**-** " + "\n**-** ".join(v), "\n**-** ", "**-** ", 450)
 
         if compact:
-            icmds = [(f'{c} (i)' if c not in self.bot.all_cmds[ctx.guild.id]['cmds_name_list']
+            icmds = [(f'{c} (i)' if c not in self.bot.all_cmds[ctx.guild.id]['cmds']
                       else f'~~{c} (i)~~') for c in self.bot.all_cmds[ctx.guild.id]['inh_cmds_name_list']]
             cmds.extend(icmds)
             ret = dutils.getParts2kByDelimiter(' | '.join(cmds), ' | ')
@@ -9,9 +9,9 @@ import textwrap
 import traceback
 from contextlib import redirect_stdout
 
-import aiohttp
 import discord
 from utils.dataIOa import dataIOa
+from utils.http import http
 import asyncio
 from discord.ext import commands
 
@@ -91,22 +91,21 @@ class Debugger(commands.Cog):
 
             if result:
                 if len(str(result)) > 1950:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post("https://hastebin.com/documents",
-                                                data=str(result).encode('utf-8')) as resp:
-                            if resp.status == 200:
-                                haste_out = await resp.json()
-                                url = "https://hastebin.com/" + haste_out["key"]
-                            else:
-                                with open("tmp/py_output.txt", "w") as f:
-                                    f.write(str(result))
-                                with open("tmp/py_output.txt", "rb") as f:
-                                    py_output = discord.File(f, "py_output.txt")
-                                    await ctx.send(
-                                        content="Error posting to hastebin. Uploaded output to file instead.",
-                                        file=py_output)
-                                    os.remove("tmp/py_output.txt")
-                                    return
+                    async with http.post("https://hastebin.com/documents",
+                                         data=str(result).encode('utf-8')) as resp:
+                        if resp.status == 200:
+                            haste_out = await resp.json()
+                            url = "https://hastebin.com/" + haste_out["key"]
+                        else:
+                            with open("tmp/py_output.txt", "w") as f:
+                                f.write(str(result))
+                            with open("tmp/py_output.txt", "rb") as f:
+                                py_output = discord.File(f, "py_output.txt")
+                                await ctx.send(
+                                    content="Error posting to hastebin. Uploaded output to file instead.",
+                                    file=py_output)
+                                os.remove("tmp/py_output.txt")
+                                return
                     result = 'Large output. Posted to Hastebin: %s' % url
                     await ctx.send(result)
 
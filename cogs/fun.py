@@ -14,7 +14,9 @@ import utils.checks as checks
 import utils.discordUtils as dutils
 import utils.timeStuff as tutils
 from models.claims import ClaimsManager, Claimed, UserSettings, History
+from models.claims import db as claims_db
 from utils.dataIOa import dataIOa
+from utils.database import run_db
 
 conf = dataIOa.load_json('settings/claims_settings.json')
 possible_for_bot = conf['use_these']
@@ -486,7 +488,8 @@ class Fun(commands.Cog):
         await self.bot.wait_until_ready()
         while True:
             try:
-                dd = Claimed.delete().where(Claimed.expires_on < datetime.datetime.utcnow()).execute()
+                dd = await run_db(claims_db, Claimed.delete().where(
+                    Claimed.expires_on < datetime.datetime.utcnow()).execute)
                 if dd > 0:
                     # print(f'---{datetime.datetime.utcnow().strftime("%c")}---')
                     # print(f'Deleted {dd} expired claim data from the db')
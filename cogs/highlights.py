@@ -12,6 +12,7 @@ from discord.ext import commands
 
 from utils.checks import manage_roles_check
 from utils.dataIOa import dataIOa
+from utils.http import http
 
 SPOILER_SETTINGS_JSON = "settings/spoiler_settings.json"
 HIGHLIGHTS_DATA_JSON = "data/highlights.json"
@@ -69,11 +70,10 @@ class Highlights(commands.Cog):
     async def is_url_image(image_url):
         image_formats = ("image/png", "image/jpeg", "image/jpg", "image/gif", "image/x-icon")
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(image_url) as resp:
-                    if resp.status == 200:
-                        if resp.headers["content-type"] in image_formats:
-                            return True
+            async with http.get(image_url) as resp:
+                if resp.status == 200:
+                    if resp.headers.get("content-type") in image_formats:
+                        return True
         except aiohttp.client_exceptions.InvalidURL:
             pass
         return False
@@ -443,7 +443,7 @@ class Highlights(commands.Cog):
                 self.highlight_msgs = self.highlight_msgs[
                     -int(guild_highlights_settings[HIGHLIGHT_MESSAGE_CACHE_SIZE]) :
                 ]
-                dataIOa.save_json(HIGHLIGHTS_DATA_JSON, self.highlight_msgs)
+                dataIOa.mark_dirty(HIGHLIGHTS_DATA_JSON, self.highlight_msgs)
                 del self.highlight_checker[event.message_id]
                 spoiler_settings = self.spoiler_settings.get(str(event.guild_id), {})
                 is_spoiler_channel = parent_channel.category.id == spoiler_settings.get(
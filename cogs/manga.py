@@ -4,11 +4,11 @@ import random
 import re
 from datetime import datetime
 
-import aiohttp
 from discord import Embed, DMChannel
 from discord.ext import commands
 
 import utils.discordUtils as dutils
+from utils.http import http
 
 
 class Manga(commands.Cog):
@@ -43,10 +43,9 @@ class Manga(commands.Cog):
                 return await ctx.send("Error, please give valid page number. Ex: .manga 20 4")
 
         url = f"https://guya.moe/api/series/{series}"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    self.bot.chapters_json[series] = json.loads(await resp.text())
+        async with http.get(url) as resp:
+            if resp.status == 200:
+                self.bot.chapters_json[series] = json.loads(await resp.text())
         if chapter == "random" and isinstance(ctx.channel, DMChannel):
             chapter = random.choice([ch for ch in self.bot.chapters_json[series]["chapters"]])
         if chapter not in self.bot.chapters_json[series]["chapters"]:
@@ -202,12 +201,11 @@ class Manga(commands.Cog):
                 if match.group(i):
                     text = text[len(match.group(i)):]
         search_response = {}
-        async with aiohttp.ClientSession() as session:
-            async with session.post(f"https://guya.moe/api/search_index/{slug}/", data={"searchQuery": text}) as resp:
-                if resp.status == 200:
-                    search_response = await resp.json()
-                else:
-                    return await ctx.send(f"Error: server returned {resp.status}")
+        async with http.post(f"https://guya.moe/api/search_index/{slug}/", data={"searchQuery": text}) as resp:
+            if resp.status == 200:
+                search_response = await resp.json()
+            else:
+                return await ctx.send(f"Error: server returned {resp.status}")
         first_word = next(iter(search_response))
         final_results = {}
         for variation, matches in search_response[first_word].items():
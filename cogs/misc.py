@@ -11,7 +11,7 @@ from discord.ext import commands
 import utils.checks as checks
 import utils.discordUtils as dutils
 import utils.timeStuff as tutils
-from models.afking import AfkTbl, AfkManager
+from models.afking import AfkManager
 
 
 class Misc(commands.Cog):
@@ -178,11 +178,7 @@ class Misc(commands.Cog):
         afk_text = afk_text.replace('@here', '@\u200bhere')
 
         ctx.bot.dont_check_this_for_afk.append(ctx.message.id)
-        afk, _ = AfkTbl.get_or_create(gid=ctx.guild.id, uid=ctx.author.id)
-        afk.msg = "" if not afk_text else ": " + afk_text
-        afk.afk_on = datetime.datetime.utcnow()
-        afk.save()
-        AfkManager.set_new_bot_afk(ctx.bot, afk)
+        await AfkManager.set_afk(ctx.bot, ctx.guild.id, ctx.author.id, "" if not afk_text else ": " + afk_text)
         await ctx.send(f'{ctx.author.mention} is now AFK{"" if not afk_text else ": " + afk_text}')
 
     @commands.cooldown(1, 10, commands.BucketType.user)
@@ -237,6 +233,10 @@ class Misc(commands.Cog):
                 await ctx.send(f'Something went wrong when trying to add **{nn}**')
         await yo.delete()
 
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        AfkManager.forget_guild(self.bot, guild.id)
+
     @commands.Cog.listener()
     async def on_message(self, message):
         if (message.author.id in self.bot.banlist) or (message.author.id in self.bot.blacklist):
@@ -248,13 +248,15 @@ class Misc(commands.Cog):
             except:
                 pass
             return
-        if message.guild and message.guild.id in self.bot.currently_afk \
-                and message.author.id in self.bot.currently_afk[message.guild.id]:
+        if not message.guild:
+            return
+        afks = await AfkManager.get_guild_afks(self.bot, message.guild.id)
+        if message.author.id in afks:
             try:
                 if isinstance(message.channel, discord.Thread):
                     return
-                msg = self.bot.currently_afk[message.guild.id][message.author.id][0]
-                AfkManager.remove_from_afk(self.bot, message.author.id, message.guild.id)
+                msg = afks[message.author.id][0]
+                await AfkManager.remove_from_afk(self.bot, message.author.id, message.guild.id)
                 pp = re.findall(r'<a?:(.*?):(\d+)>', msg)
                 for p in pp:
                     for g in self.bot.guilds:
@@ -273,10 +275,10 @@ class Misc(commands.Cog):
                 pass
         if len(message.mentions) > 0 and not message.author.bot:
             # USER is AFK: {} ~ {} ago
-            if message.guild.id not in self.bot.currently_afk:
+            if not afks:
                 return
             for ment in message.mentions:
-                if ment.id in self.bot.currently_afk[message.guild.id]:
+                if ment.id in afks:
                     now = int(datetime.datetime.now().timestamp())
 
                     if message.author.id in self.did_ping_afk_person:
@@ -298,7 +300,7 @@ class Misc(commands.Cog):
                         self.did_ping_afk_person[message.author.id] = {'t': now, 'ppl': {}}
                         self.did_ping_afk_person[message.author.id]['ppl'][ment.id] = 0
 
-                    data = self.bot.currently_afk[message.guild.id][ment.id]
+                    data = afks[ment.id]
                     elapsed = (datetime.datetime.utcnow() - data[1]).total_seconds()
                     tt = tutils.convert_sec_to_smhd(elapsed)
                     if data[0]:
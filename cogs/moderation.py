@@ -15,9 +15,12 @@ from discord.ext import commands
 import utils.checks as checks
 import utils.discordUtils as dutils
 import utils.timeStuff as tutils
-from models.moderation import (Reminderstbl, Actions, Blacklist, ModManager)
+from models.moderation import (Reminderstbl, Actions)
+from models.moderation import db as moderation_db
 from models.serversetup import SSManager
 from models.sticky_message import StickyMsg
+from models.sticky_message import db as sticky_db
+from utils.database import run_db
 from utils.SimplePaginator import SimplePaginator
 from discord.errors import NotFound
 
@@ -25,6 +28,10 @@ logger = logging.getLogger('info')
 error_logger = logging.getLogger('error')
 
 
+# seconds to wait after a message before reposting a sticky, so a burst reposts it once
+STICKY_DEBOUNCE = 2
+
+
 class Moderation(commands.Cog):
     def __init__(
             self,
@@ -33,8 +40,9 @@ class Moderation(commands.Cog):
         self.bot = bot
         self.tried_setup = False
         # removing multi word cmds, cross out unavail inh cmd
+        # channel id -> {'content', 'freq', 'last_post' (timestamp), 'msg_id', 'reposting'}
+        self.sticky_state = {}
         self.sticky_messages = self.get_current_sticky()
-        self.last_sticky_repost = {}
 
     def get_current_sticky(self):
         sticky_messages = {}
@@ -47,9 +55,36 @@ class Moderation(commands.Cog):
                 sticky_messages[guild_id] = {}
 
             sticky_messages[guild_id][channel_id] = sticky.message
+            self.set_sticky_state(sticky.channel_id, sticky.message, sticky.sticky_frequency_update,
+                                  sticky.create_date, sticky.current_sticky_message_id)
 
         return sticky_messages
 
+    def set_sticky_state(self, channel_id, content, freq, last_post, msg_id):
+        self.sticky_state[channel_id] = {'content': content, 'freq': freq, 'last_post': last_post.timestamp(),
+                                         'msg_id': msg_id, 'reposting': False}
+
+    async def repost_sticky(self, channel):
+        state = self.sticky_state[channel.id]
+        state['reposting'] = True
+        try:
+            # a burst of messages only causes the one repost after it
+            await asyncio.sleep(STICKY_DEBOUNCE)
+            if self.sticky_state.get(channel.id) is not state:
+                return  # stopped meanwhile
+            try:
+                await channel.get_partial_message(state['msg_id']).delete()
+            except discord.errors.NotFound:
+                pass
+            new_sticky_message = await channel.send(state['content'])
+            now = datetime.datetime.utcnow()
+            state['msg_id'] = new_sticky_message.id
+            state['last_post'] = now.timestamp()
+            await run_db(sticky_db, StickyMsg.update(current_sticky_message_id=new_sticky_message.id,
+                                                     create_date=now).where(StickyMsg.channel_id == channel.id).execute)
+        finally:
+            state['reposting'] = False
+
     async def set_server_stuff(self):
         if not self.tried_setup:
             self.tried_setup = True
@@ -132,10 +167,9 @@ class Moderation(commands.Cog):
                         f"Old reason: {old_reason}\n"
                         f"New reason: {reason}")
             try:
-                if not ctx.bot.from_serversetup:
-                    ctx.bot.from_serversetup = await SSManager.get_setup_formatted(ctx.bot)
-                if ctx.guild.id not in ctx.bot.from_serversetup: return
-                chan = ctx.bot.from_serversetup[ctx.guild.id]['modlog']
+                sup = await SSManager.get_guild_setup(ctx.bot, ctx.guild.id)
+                if not sup: return
+                chan = sup['modlog']
                 log_in_chan = None
                 if chan.id != case.logged_in_ch:
                     log_in_chan = ctx.guild.get_channel(case.logged_in_ch)
@@ -144,21 +178,28 @@ class Moderation(commands.Cog):
                 if not log_in_chan:
                     return
                 msg = None
-                d = case.logged_after - datetime.timedelta(minutes=5)
+                if case.logged_msg_id:
+                    try:
+                        msg = await log_in_chan.fetch_message(case.logged_msg_id)
+                    except discord.NotFound:
+                        return
+                else:
+                    # legacy rows from before the message id was stored
+                    d = case.logged_after - datetime.timedelta(minutes=5)
 
-                # Get the channel history
-                history = log_in_chan.history(limit=2000, after=d)
+                    # Get the channel history
+                    history = log_in_chan.history(limit=2000, after=d)
 
-                # Filter the messages using list comprehension
-                stuff = []
-                async for m in history:
-                    if len(m.embeds) == 1 and m.embeds[0].footer and f'Case id: {case_id}' in str(
-                            m.embeds[0].footer.text):
-                        stuff.append(m)
+                    # Filter the messages using list comprehension
+                    stuff = []
+                    async for m in history:
+                        if len(m.embeds) == 1 and m.embeds[0].footer and f'Case id: {case_id}' in str(
+                                m.embeds[0].footer.text):
+                            stuff.append(m)
 
-                if not stuff:
-                    return
-                msg = stuff[-1]
+                    if not stuff:
+                        return
+                    msg = stuff[-1]
                 if msg:
                     em = msg.embeds[0]
                     em = em.copy()
@@ -179,12 +220,17 @@ class Moderation(commands.Cog):
                     sup = self.bot.from_serversetup[ctx.guild.id]
                     case.logged_after = datetime.datetime.utcnow()
                     case.logged_in_ch = log_in_chan.id
+                    case.logged_msg_id = msg.id
+                    case.logged_hook_id = msg.webhook_id
                     case.save()
                     try:
+                        # the hook can only edit its own messages, the rest were sent by the bot itself
+                        editor = sup['hook_modlog'].edit_message if msg.webhook_id else msg.edit
+                        args = (msg.id,) if msg.webhook_id else ()
                         if "*No reason provided." in cnt:
-                            await sup['hook_modlog'].edit_message(msg.id, embed=em)  # edit the old one
+                            await editor(*args, embed=em)  # edit the old one
                         else:
-                            await sup['hook_modlog'].edit_message(msg.id, embed=em, content=cnt)  # edit the old one
+                            await editor(*args, embed=em, content=cnt)  # edit the old one
                     except:
                         await ctx.send("Unable to edit the message. Sending new one instead.")
                         await dutils.try_send_hook(ctx.guild, self.bot, hook=sup['hook_reg'],
@@ -582,9 +628,9 @@ class Moderation(commands.Cog):
             if mute_role not in after.roles and mute_role in before.roles:
                 # unmute logic time
                 try:
-                    muted = Reminderstbl.get(Reminderstbl.guild == before.guild.id, Reminderstbl.user_id == before.id,
-                                             Reminderstbl.meta.startswith('mute'))
-                    muted.delete_instance()
+                    await run_db(moderation_db, Reminderstbl.delete().where(
+                        Reminderstbl.guild == before.guild.id, Reminderstbl.user_id == before.id,
+                        Reminderstbl.meta.startswith('mute')).execute)
                 except:
                     pass
                 entry_found = False
@@ -1169,14 +1215,12 @@ class Moderation(commands.Cog):
         user_ids = list(set(user_ids))  # remove dupes
         if len(user_ids) > 90: return await ctx.send("Can only blacklist up to 90 at once.")
         if len(user_ids) == 0: return await ctx.send("You didn't input any ids to blacklist.")
-        data = [{'guild': ctx.guild.id, 'user_id': uid} for uid in user_ids]
-        de = Blacklist.delete().where(Blacklist.guild == ctx.guild.id, Blacklist.user_id << user_ids).execute()
-        if de > 0:
+        await self.bot.moderation_blacklist.ensure_loaded()
+        added = self.bot.moderation_blacklist.add(ctx.guild.id, user_ids)
+        if len(added) < len(user_ids):
             await ctx.send("You tried blacklisting some ids that were already blacklisted "
                            f"check those ids by using `{dutils.bot_pfx(ctx.bot, ctx.message)}blacklistshow`",
                            delete_after=15)
-        Blacklist.insert_many(data).execute()
-        self.bot.moderation_blacklist = ModManager.return_blacklist_lists()
         msg = await ctx.send("Done. (Trying to also ban the listed members if possible...)")
         with ctx.channel.typing():
             for uid in user_ids:
@@ -1207,13 +1251,11 @@ class Moderation(commands.Cog):
         # bs = [b for b in Blacklist.select().dicts()]
         # if not bs: return await ctx.send("Blacklist is empty.")
         # ret = ' '.join([b[''] for b in bs])
-        if -1 in self.bot.moderation_blacklist:
-            self.bot.moderation_blacklist = ModManager.return_blacklist_lists()
-        if ctx.guild.id in self.bot.moderation_blacklist:
-            smb = self.bot.moderation_blacklist[ctx.guild.id]
-            if smb:
-                ret = f"```\n{' '.join([str(b) for b in smb])}```"
-                return await dutils.print_hastebin_or_file(ctx, ret)
+        await self.bot.moderation_blacklist.ensure_loaded()
+        smb = self.bot.moderation_blacklist.get(ctx.guild.id)
+        if smb:
+            ret = f"```\n{' '.join([str(b) for b in sorted(smb)])}```"
+            return await dutils.print_hastebin_or_file(ctx, ret)
 
         await ctx.send("Blacklist is empty.")
 
@@ -1223,7 +1265,8 @@ class Moderation(commands.Cog):
     async def whitelist(self, ctx, *user_ids: int):
         """Delete ids from the blacklist"""
         user_ids = list(set(user_ids))  # remove dupes
-        de = Blacklist.delete().where(Blacklist.guild == ctx.guild.id, Blacklist.user_id << user_ids).execute()
+        await self.bot.moderation_blacklist.ensure_loaded()
+        de = len(self.bot.moderation_blacklist.remove(ctx.guild.id, user_ids))
         await ctx.send(f"Removed **{de}** ids from the blacklist.")
         if de > 0:
             act_id = await dutils.moderation_action(ctx, "", "whitelist", ctx.message.content)
@@ -1593,10 +1636,11 @@ class Moderation(commands.Cog):
         self.sticky_messages[guild_id][channel_id] = sticky_content
 
         # Save the sticky message to the database
-        new_sticky = StickyMsg.create(channel_id=channel.id, guild_id=ctx.guild.id, message=sticky_content,
-                                      current_sticky_message_id=new_sticky_message.id,
-                                      sticky_frequency_update=seconds,
-                                      create_date=datetime.datetime.utcnow())
+        now = datetime.datetime.utcnow()
+        self.set_sticky_state(channel.id, sticky_content, seconds, now, new_sticky_message.id)
+        await run_db(sticky_db, StickyMsg.create, channel_id=channel.id, guild_id=ctx.guild.id,
+                     message=sticky_content, current_sticky_message_id=new_sticky_message.id,
+                     sticky_frequency_update=seconds, create_date=now)
 
         await ctx.send(f"Sticky message created in {channel.mention}.")
 
@@ -1609,8 +1653,9 @@ class Moderation(commands.Cog):
 
         if confirmation:
             # Remove sticky from the StickyMsg model and save it
-            StickyMsg.delete().where(StickyMsg.channel_id == channel.id).execute()
-            self.sticky_messages[str(ctx.guild.id)].pop(str(channel.id), None)
+            await run_db(sticky_db, StickyMsg.delete().where(StickyMsg.channel_id == channel.id).execute)
+            self.sticky_messages.get(str(ctx.guild.id), {}).pop(str(channel.id), None)
+            self.sticky_state.pop(channel.id, None)
 
             await ctx.send(f"Sticky message in {channel.mention} stopped.")
 
@@ -1638,7 +1683,9 @@ class Moderation(commands.Cog):
 
         if confirmation:
             # Remove all stickies in this guild from the StickyMsg model and save it
-            StickyMsg.delete().where(StickyMsg.guild_id == ctx.guild.id).execute()
+            await run_db(sticky_db, StickyMsg.delete().where(StickyMsg.guild_id == ctx.guild.id).execute)
+            for channel_id in self.sticky_messages.get(str(ctx.guild.id), {}):
+                self.sticky_state.pop(int(channel_id), None)
             self.sticky_messages[str(ctx.guild.id)] = {}
 
             await ctx.send("All sticky messages in this guild have been stopped.")
@@ -1648,28 +1695,11 @@ class Moderation(commands.Cog):
         if message.author.bot or message.guild is None:
             return
 
-        guild_id = str(message.guild.id)
-        channel_id = str(message.channel.id)
-
-        if guild_id in self.sticky_messages and channel_id in self.sticky_messages[guild_id]:
-            sticky_message = self.sticky_messages[guild_id][channel_id]
-            sticky_data = StickyMsg.get(StickyMsg.guild_id == guild_id, StickyMsg.channel_id == channel_id)
-
-            update_frequency = sticky_data.sticky_frequency_update
-            current_time = datetime.datetime.utcnow().timestamp()
-            last_update_time = sticky_data.create_date.timestamp()
-
-            if current_time - last_update_time >= update_frequency:
-                try:
-                    old_sticky_message = await message.channel.fetch_message(sticky_data.current_sticky_message_id)
-                    await old_sticky_message.delete()
-                except discord.errors.NotFound:
-                    pass
-
-                new_sticky_message = await message.channel.send(sticky_message)
-                StickyMsg.update(current_sticky_message_id=new_sticky_message.id,
-                                 create_date=datetime.datetime.utcnow()).where(
-                    (StickyMsg.guild_id == guild_id) & (StickyMsg.channel_id == channel_id)).execute()
+        state = self.sticky_state.get(message.channel.id)
+        if not state or state['reposting']:
+            return
+        if datetime.datetime.utcnow().timestamp() - state['last_post'] >= state['freq']:
+            await self.repost_sticky(message.channel)
 
 
 async def setup(
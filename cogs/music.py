@@ -1,10 +1,6 @@
 import logging
 import os
 import asyncio
-import re
-import subprocess
-import time
-import traceback
 from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 import shlex
@@ -17,11 +13,24 @@ from fuzzywuzzy import fuzz, process
 import threading
 from utils import checks
 from utils.SimplePaginator import SimplePaginator
+from utils.audiocache import AudioCache, cache_key
+from utils.executors import get_pool
+from utils.loudness import LoudnessCache
 from asyncio import ensure_future
 
 logger = logging.getLogger('info')
 error_logger = logging.getLogger('error')
 
+# how many queued songs after the current one get analyzed ahead of time
+PREFETCH_AHEAD = 2
+# max songs being prefetched at once, across all guilds
+PREFETCH_CONCURRENCY = 2
+# max downloads running at once, in total and per guild
+DOWNLOAD_WORKERS = 4
+GUILD_DOWNLOADS = 2
+# song info that's kept in the audio cache, so cache hits don't need a full extraction
+SONG_META = ('title', 'artist', 'thumbnail', 'webpage_url', 'duration')
+
 
 class CustomFFmpegPCMAudio(FFmpegPCMAudio):
     def __init__(self, *args, **kwargs):
@@ -47,14 +56,18 @@ class Music(commands.Cog):
         # self.check_queue.start()
         self.cleanup_tmp_folder()
         self.event_loop = asyncio.get_running_loop()
+        self.loudness = LoudnessCache()
+        self.audio_cache = AudioCache()
+        self.prefetch_tasks = {}  # local_path -> task that analyzes it
+        self.prefetch_sem = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+        self.download_sem = asyncio.Semaphore(DOWNLOAD_WORKERS)
+        self.guild_download_sems = {}
 
     def schedule_coroutine(self, coroutine):
         self.event_loop.call_soon_threadsafe(asyncio.ensure_future, coroutine)
 
-    def get_song_path(self, guild_id):
-        return f"{self.tmp_folder}/music_{guild_id}"
-
     def cleanup_tmp_folder(self):
+        # songs used to be downloaded per guild into tmp/music_<gid>, now they live in the audio cache
         tmp_path = os.path.join(os.getcwd(), self.tmp_folder)
         if os.path.exists(tmp_path):
             for folder in os.listdir(tmp_path):
@@ -77,11 +90,9 @@ class Music(commands.Cog):
             song_path = self.queues[guild_id][0]["local_path"]
             song_title = self.queues[guild_id][0]["title"]
 
-            # Get the audio change value
-            logger.info(f'Adjusting volume for {song_path}')
-            audio_change = await self.adjust_volume(song_path)
+            # Get the audio change value (usually prefetched while the previous song played)
+            audio_change = await self.get_gain(self.queues[guild_id][0])
             logger.info(f'Audio change for {song_path} ({song_title}) was {audio_change}')
-            # audio_change = 0
 
             # Add the volume change to the FFmpeg options
             options = f'-vn -b:a 320k -af volume={audio_change}dB'
@@ -92,7 +103,7 @@ class Music(commands.Cog):
             # options = options.split(' ')
             source = CustomFFmpegPCMAudio(song_path, options=options, before_options=before_options)
             if guild_id not in self.voice_clients:
-                self.queues.pop(guild_id, None)
+                self.release_songs(self.queues.pop(guild_id, []))
                 return
 
             # Play the audio with the adjusted volume
@@ -101,49 +112,85 @@ class Music(commands.Cog):
             voice_client.source.start_time = discord.utils.utcnow()  # Store start time
             if start_time:
                 source.start_time = discord.utils.utcnow() - timedelta(seconds=int(start_time))
+            self.prefetch(guild_id)
         else:
             # await self.dc_from_vc(guild_id)
             return  # something is already playing, play it later
 
-    async def delete_song_file_with_retries(self, song_path, retries=3, delay=120):
-        for i in range(retries):
-            try:
-                os.remove(song_path)
-                logger.info(f"Deleted file: {song_path}")
-                break
-            except OSError as e:
-                if i < retries - 1:
-                    logger.warning(f"Error deleting file (attempt {i + 1}): {song_path}\n{e}")
-                    await asyncio.sleep(delay)
-                else:
-                    logger.error(f"Failed to delete file after {retries} attempts: {song_path}\n{e}")
+    def prefetch(self, guild_id):
+        """Analyze the next few queued songs in the background, so the next one starts right away"""
+        for song in self.queues.get(guild_id, [])[:PREFETCH_AHEAD + 1]:
+            path = song["local_path"]
+            if "gain" in song or path in self.prefetch_tasks:
+                continue
+            self.prefetch_tasks[path] = self.event_loop.create_task(self._prefetch_song(song))
+
+    async def _prefetch_song(self, song):
+        """:return: the gain or None if it failed, then it's analyzed again when the song is played"""
+        try:
+            async with self.prefetch_sem:
+                return await self._analyze_song(song)
+        except Exception as ex:
+            error_logger.error(f"Prefetching {song['local_path']} failed: {ex}")
+            return None
+        finally:
+            if self.prefetch_tasks.get(song["local_path"]) is asyncio.current_task():
+                del self.prefetch_tasks[song["local_path"]]
+
+    async def _analyze_song(self, song):
+        """:return: the gain or None if it couldn't be analyzed, then it's tried again next time"""
+        key = song.get("cache_key")
+        gain = self.audio_cache.get_meta(key, "gain") if key else None
+        if gain is None:
+            gain = await self.adjust_volume(song["local_path"])
+            if gain is None:
+                return None
+            if key: self.audio_cache.set_meta(key, gain=gain)
+        song["gain"] = gain
+        return gain
+
+    async def get_gain(self, song):
+        if "gain" in song:
+            return song["gain"]
+        task = self.prefetch_tasks.get(song["local_path"])
+        if task:
+            # it might get cancelled (queue cleared) or fail, then analyze it here
+            await asyncio.wait([task])
+            if not task.cancelled() and task.result() is not None:
+                return task.result()
+        gain = await self._analyze_song(song)
+        return 0 if gain is None else gain  # plays un-normalized
+
+    def release_songs(self, songs):
+        """Queue entries that were removed, their files can be evicted from the cache again"""
+        queued = {s["local_path"] for q in self.queues.values() for s in q}
+        for song in songs:
+            # no point analyzing songs that aren't queued anywhere anymore
+            task = self.prefetch_tasks.get(song["local_path"]) if song["local_path"] not in queued else None
+            if task:
+                task.cancel()
+                del self.prefetch_tasks[song["local_path"]]
+            self.audio_cache.release(song.get("cache_key"))
 
     async def song_finished_playing(self, guild_id, song_path, error=None):
         if error:
             print(f"Error while playing song: {error}")
 
-        # Delay the deletion of the file
         loop = asyncio.get_running_loop()
-        loop.call_later(30, self.schedule_coroutine, self.delete_song_file_with_retries(song_path))
-
         if self.queues[guild_id]:  # Check if the list is not empty
-            self.queues[guild_id].pop(0)
+            # the file stays in the audio cache for the next time someone wants it
+            self.release_songs([self.queues[guild_id].pop(0)])
             loop.create_task(self.play_next_song(guild_id))
         if not self.queues[guild_id]:
             await self.dc_from_vc(guild_id)
 
-    def delete_song_file(self, guild_id, song_path):
-        try:
-            os.remove(song_path)
-            print(f"Deleted file: {song_path}")
-        except Exception as e:
-            print(f"Error deleting file: {song_path}\n{e}")
-
-    async def download_song(self, url, guild_id, playlist=False):
-        ydl_opts = {
+    def _ydl_opts(self, playlist=False):
+        return {
             'format': '251/250/bestaudio',  # Opus format
-            'outtmpl': f"{self.get_song_path(guild_id)}/{int(time.time())}.%(ext)s",
+            'outtmpl': self.audio_cache.outtmpl,
             "noplaylist": not playlist,  # Handle playlists
+            # playlist entries are only listed here, each one is resolved when it's downloaded
+            "extract_flat": 'in_playlist' if playlist else False,
             "source_address": "0.0.0.0",  # For IPv6 issues
             'postprocessors': [{
                 'key': 'FFmpegExtractAudio',
@@ -155,48 +202,116 @@ class Music(commands.Cog):
             # 'verbose': True
         }
 
-        loop = asyncio.get_event_loop()
+    def _fetch(self, ydl, info):
+        """Blocking, get a single (possibly flat) entry into the audio cache"""
+        if info.get("duration") and info["duration"] > 10800:  # 3 hours
+            raise Exception("Song is too long. [Max 3 hours]")
+        key = cache_key(info)
+        with self.audio_cache.downloading(key):
+            cached = self.audio_cache.lookup(key)
+            if not cached:
+                info = ydl.process_ie_result(info, download=True)
+                path = os.path.relpath(info.get('requested_downloads')[0].get('filepath'))
+                self.audio_cache.add(key, path, **{k: info.get(k) for k in SONG_META})
+        if cached:
+            path = cached['path']
+            info = {**info, **{k: cached[k] for k in SONG_META if cached.get(k) is not None}}
+            if not all(info.get(k) for k in ('webpage_url', 'thumbnail')):
+                info = ydl.process_ie_result(info, download=False)
+        info['cache_key'] = key
+        return path, info
+
+    def _fetch_blocking(self, info):
+        with yt_dlp.YoutubeDL(self._ydl_opts()) as ydl:
+            return self._fetch(ydl, info)
+
+    def _download_song_blocking(self, url):
+        with yt_dlp.YoutubeDL(self._ydl_opts()) as ydl:
+            info = ydl.extract_info(url, download=False)
+            if 'entries' in info:  # search results
+                info['entries'] = list(info['entries'])
+                if not info['entries']:
+                    return None, info
+                song_path, info['entries'][0] = self._fetch(ydl, info['entries'][0])
+                return song_path, info
+            return self._fetch(ydl, info)
+
+    def _list_playlist_blocking(self, url):
+        with yt_dlp.YoutubeDL(self._ydl_opts(playlist=True)) as ydl:
+            info = ydl.extract_info(url, download=False)
+        entries = list(info.get('entries') or [])
+        if len(entries) > 10:
+            raise Exception("Playlist is too long. [Max 10 songs]")
+        return entries
+
+    async def run_download(self, guild_id, fnc, *args):
+        """
+        Run a blocking download with bounded concurrency, a guild first waits for one of
+        its own slots and only then for a global one, so one guild can't take all of them
+        """
+        guild_sem = self.guild_download_sems.setdefault(guild_id, asyncio.Semaphore(GUILD_DOWNLOADS))
+        async with guild_sem:
+            async with self.download_sem:
+                try:
+                    return await get_pool('network').run(fnc, *args)
+                except Exception as ex:
+                    raise Exception(ex)
+
+    async def download_song(self, url, guild_id):
+        """
+        Download into the shared audio cache, songs that are already there aren't downloaded again
+        The returned info dicts have a "cache_key", which is referenced until it's released
+        """
+        return await self.run_download(guild_id, self._download_song_blocking, url)
 
-        def _download_song_blocking():
-            try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-
-                    if playlist and info.get('entries') and len(info.get('entries')):
-                        entries = info['entries']
-                        if len(entries) > 10:
-                            raise Exception("Playlist is too long. [Max 10 songs]")
-
-                        song_paths = []
-                        for entry in entries:
-                            if entry.get("duration") and entry["duration"] > 10800:  # 3 hours
-                                raise Exception("Song is too long. [Max 3 hours]")
-                            info_entry = ydl.extract_info(entry['url'], download=True)
-                            filename = 'tmp' + ''.join(
-                                info_entry.get('requested_downloads')[0].get('filepath').split('tmp')[1:])
-                            song_paths.append(filename)
-
-                        return song_paths, entries
-
-                    if info.get("duration") and info["duration"] > 10800:  # 3 hours
-                        raise Exception("Song is too long. [Max 3 hours]")
-
-                    info = ydl.extract_info(url, download=True)
-                    if info.get('entries'):
-                        info_entry0 = info['entries'][0]
-                    else:
-                        info_entry0 = info
-                    filename = 'tmp' + ''.join(
-                        info_entry0.get('requested_downloads')[0].get('filepath').split('tmp')[1:])
-                    return filename, info
+    async def connect_to_author(self, ctx):
+        """:return: False if the author isn't in a voice channel"""
+        # Check if user is in a voice channel
+        if ctx.author.voice is None:
+            await ctx.send("You must be in a voice channel to use this command.")
+            return False
 
-            except Exception as ex:
-                raise Exception(ex)
+        # Connect to the voice channel if not connected
+        if ctx.guild.id not in self.voice_clients or not self.voice_clients[ctx.guild.id].is_connected():
+            voice_channel = ctx.author.voice.channel
+            self.voice_clients[ctx.guild.id] = await voice_channel.connect(self_deaf=True)
+        return True
 
-        try:
-            return await loop.run_in_executor(None, _download_song_blocking)
-        except Exception as ex:
-            raise Exception(ex)
+    def song_title_from_info(self, info):
+        if info.get("artist"):
+            return f'{info.get("title")} by {info.get("artist")}'
+        return f'{info.get("title")}'
+
+    async def enqueue(self, ctx, song_path, info):
+        """
+        Add a downloaded song to the guild's queue and start playing if nothing is
+        :return: the song's title or None if the bot isn't in vc anymore
+        """
+        if ctx.guild.id not in self.voice_clients:
+            self.audio_cache.release(info.pop("cache_key", None))
+            self.release_songs(self.queues.pop(ctx.guild.id, []))
+            return None
+
+        song_title = self.song_title_from_info(info)
+        song = {
+            "title": song_title,
+            "thumbnail": info['thumbnail'],
+            "url": info['webpage_url'],
+            "duration": info['duration'],
+            "requester": ctx.author,
+            "song_title": song_title,
+            "local_path": song_path,
+        }
+        # the queue owns the cache reference from here on
+        song["cache_key"] = info.pop("cache_key", None)
+        if ctx.guild.id not in self.queues:
+            self.queues[ctx.guild.id] = []
+
+        self.queues[ctx.guild.id].append(song)
+
+        await self.play_next_song(ctx.guild.id)
+        self.prefetch(ctx.guild.id)
+        return song_title
 
     @commands.cooldown(1, 25, commands.BucketType.user)
     @commands.command(aliases=['pm'])
@@ -209,9 +324,16 @@ class Music(commands.Cog):
         queries = [q.strip() for q in query.split('|')]
         if len(queries) > 5:
             return await ctx.send("Max 5 songs can be added at once.")
-        for q in queries:
-            await self.play(ctx, query=q)
-            await asyncio.sleep(2)
+        if not await self.connect_to_author(ctx):
+            return
+
+        # everything downloads at once, but songs are queued in the given order
+        msgs = [await ctx.send(f"🔃 Adding `{self.cleaned_query(q)}` to the queue...".replace('@', '@\u200b'))
+                for q in queries]
+        resolving = [asyncio.create_task(self.resolve_query(self.cleaned_query(q), ctx.guild.id, m))
+                     for q, m in zip(queries, msgs)]
+        for q, m, task in zip(queries, msgs, resolving):
+            await self.add_resolved(ctx, self.cleaned_query(q), m, task)
 
     def cleaned_query(self, query):
         # Remove "<" from the start and ">" from the end, if present
@@ -233,6 +355,66 @@ class Music(commands.Cog):
 
         return query
 
+    async def resolve_query(self, query, guild_id, m):
+        """
+        Download a yt link/id or the first search result for the query
+        :return: (song_path, info) or None if nothing good enough was found
+        """
+        song_path = None
+        if "youtube.com" in query or "youtu.be" in query or len(query) == 11:
+            # If it's a link or ID, pass it directly to the download_song function
+            try:
+                song_path, info = await self.download_song(query, guild_id)
+            except:
+                song_path = None
+                pass
+        if song_path is None:
+            await m.edit(content=f"🔎 Adding `{query}` to the queue..."
+                                 f"\nProvided query was not a youtube id or link. Trying search..."
+                         .replace('@', '@\u200b'))
+            # Otherwise, search for the song using yt-dlp
+            search_query = f"ytsearch1:{query}"
+            song_path, info = await self.download_song(search_query, guild_id)
+            if info.get('entries') and len(info.get('entries')):
+                info = info['entries'][0]  # first one
+            else:
+                raise Exception("Nothing found")
+
+            # Perform fuzzy search to correct typos in the query
+            song_title = f'{info.get("title")} by {info.get("artist")}'
+            title_conbos = [song_title, info.get('title'), info.get('description'), info.get('artist')]
+            best_match = process.extractOne(query, title_conbos, scorer=fuzz.token_set_ratio)
+            if best_match[1] < 50:  # Threshold for fuzzy search
+                self.audio_cache.release(info.get("cache_key"))
+                return None
+        return song_path, info
+
+    async def add_resolved(self, ctx, query, m, resolving):
+        """Wait for a resolve_query (task) and queue its song, reporting on m"""
+        resolved = None
+        try:
+            resolved = await resolving
+            if not resolved:
+                return await m.edit(content=f"❌ Could not find anything for `{query}`.")
+            song_path, info = resolved
+            song_title = await self.enqueue(ctx, song_path, info)
+            if song_title is None:
+                return await ctx.send("Bot left vc before song could be added.")
+
+            # await m.edit(content=f"✅ Added `{song_title}` to the queue.".replace('@', '@\u200b'))
+            em = Embed(color=discord.Color.green(),
+                       description=f"✅ Added [**{song_title}**]({info['webpage_url']})"
+                                   f" to the queue.".replace('@', '@\u200b'))
+            em.set_footer(text=f'Requested by {ctx.author} ({ctx.author.id})')
+            await m.edit(content="", embed=em)
+
+        except Exception as ex:
+            # print(ex)
+            error_logger.error(f"❌ Failed to add `{query}` to queue: {ex}")
+            if resolved:  # still holds its cache reference if it never made it into the queue
+                self.audio_cache.release(resolved[1].pop("cache_key", None))
+            await m.edit(content=f"❌ Failed to add `{query}` to queue. Try again maybe?".replace('@', '@\u200b'))
+
     @commands.cooldown(1, 5, commands.BucketType.user)
     @commands.command(aliases=['p', 'enque'])
     async def play(self, ctx, *, query):
@@ -244,86 +426,15 @@ class Music(commands.Cog):
         `[p]play PEbD3rIvais` (<--- youtube id)
 
         """
-        # Check if user is in a voice channel
-        if ctx.author.voice is None:
-            await ctx.send("You must be in a voice channel to use this command.")
+        if not await self.connect_to_author(ctx):
             return
 
         query = self.cleaned_query(query)
 
-        # Connect to the voice channel if not connected
-        if ctx.guild.id not in self.voice_clients or not self.voice_clients[ctx.guild.id].is_connected():
-            voice_channel = ctx.author.voice.channel
-            self.voice_clients[ctx.guild.id] = await voice_channel.connect(self_deaf=True)
-
         # Download the song and store its info
         async with ctx.typing():
             m = await ctx.send(f"🔃 Adding `{query}` to the queue...".replace('@', '@\u200b'))
-
-            try:
-                song_path = None
-                if "youtube.com" in query or "youtu.be" in query or len(query) == 11:
-                    # If it's a link or ID, pass it directly to the download_song function
-                    try:
-                        song_path, info = await self.download_song(query, ctx.guild.id)
-                    except:
-                        song_path = None
-                        pass
-                if song_path is None:
-                    await m.edit(content=f"🔎 Adding `{query}` to the queue..."
-                                         f"\nProvided query was not a youtube id or link. Trying search..."
-                                 .replace('@', '@\u200b'))
-                    # Otherwise, search for the song using yt-dlp
-                    search_query = f"ytsearch1:{query}"
-                    song_path, info = await self.download_song(search_query, ctx.guild.id)
-                    if info.get('entries') and len(info.get('entries')):
-                        info = info['entries'][0]  # first one
-                    else:
-                        raise Exception("Nothing found")
-
-                    # Perform fuzzy search to correct typos in the query
-                    song_title = f'{info.get("title")} by {info.get("artist")}'
-                    title_conbos = [song_title, info.get('title'), info.get('description'), info.get('artist')]
-                    best_match = process.extractOne(query, title_conbos, scorer=fuzz.token_set_ratio)
-                    if best_match[1] < 50:  # Threshold for fuzzy search
-                        await m.edit(content=f"❌ Could not find anything for `{query}`.")
-                        return
-
-                if info.get("artist"):
-                    song_title = f'{info.get("title")} by {info.get("artist")}'
-                else:
-                    song_title = f'{info.get("title")}'
-
-                if ctx.guild.id not in self.queues:
-                    self.queues[ctx.guild.id] = []
-
-                if ctx.guild.id not in self.voice_clients:
-                    self.queues.pop(ctx.guild.id, None)
-                    return await ctx.send("Bot left vc before song could be added.")
-
-                self.queues[ctx.guild.id].append({
-                    "title": song_title,
-                    "thumbnail": info['thumbnail'],
-                    "url": info['webpage_url'],
-                    "duration": info['duration'],
-                    "requester": ctx.author,
-                    "song_title": song_title,
-                    "local_path": song_path
-                })
-
-                await self.play_next_song(ctx.guild.id)
-
-                # await m.edit(content=f"✅ Added `{song_title}` to the queue.".replace('@', '@\u200b'))
-                em = Embed(color=discord.Color.green(),
-                           description=f"✅ Added [**{song_title}**]({info['webpage_url']})"
-                                       f" to the queue.".replace('@', '@\u200b'))
-                em.set_footer(text=f'Requested by {ctx.author} ({ctx.author.id})')
-                await m.edit(content="", embed=em)
-
-            except Exception as ex:
-                # print(ex)
-                error_logger.error(f"❌ Failed to add `{query}` to queue: {ex}")
-                await m.edit(content=f"❌ Failed to add `{query}` to queue. Try again maybe?".replace('@', '@\u200b'))
+            await self.add_resolved(ctx, query, m, self.resolve_query(query, ctx.guild.id, m))
 
     @commands.check(checks.owner_check)
     @commands.command(aliases=['pp'])
@@ -332,45 +443,57 @@ class Music(commands.Cog):
         Same as play but only accepts playlist links/ids
         Currently not enabled publicly
         """
-        # Check if user is in a voice channel
-        if ctx.author.voice is None:
-            await ctx.send("You must be in a voice channel to use this command.")
+        if not await self.connect_to_author(ctx):
             return
 
-        # Connect to the voice channel if not connected
-        if ctx.guild.id not in self.voice_clients or not self.voice_clients[ctx.guild.id].is_connected():
-            voice_channel = ctx.author.voice.channel
-            self.voice_clients[ctx.guild.id] = await voice_channel.connect(self_deaf=True)
-
         # Download the songs and store their info
         async with ctx.typing():
             m = await ctx.send(f"🔃 Adding `{query}` playlist to queue...".replace('@', '@\u200b'))
 
+            fetches = []
+            next_fetch = 0  # fetches before this one were handled by the loop
             try:
-                song_paths, info_entries = await self.download_song(query, ctx.guild.id, playlist=True)
-
-                for song_path, info in zip(song_paths, info_entries):
-                    song_title = f'{info.get("title")} by {info.get("artist")}'
-
-                    if ctx.guild.id not in self.queues:
-                        self.queues[ctx.guild.id] = []
-
-                    self.queues[ctx.guild.id].append({
-                        "title": song_title,
-                        "thumbnail": info['thumbnail'],
-                        "url": info['webpage_url'],
-                        "duration": info['duration'],
-                        "requester": ctx.author,
-                        "song_title": song_title,
-                        "local_path": song_path
-                    })
-
-                    await m.edit(content=f"✅ Added `{song_title}` to queue.".replace('@', '@\u200b'))
-                await self.play_next_song(ctx.guild.id)
+                entries = await self.run_download(ctx.guild.id, self._list_playlist_blocking, query)
+                # all entries download at once (bounded by run_download), the first one plays as soon as it's ready
+                fetches = [asyncio.create_task(self.run_download(ctx.guild.id, self._fetch_blocking, entry))
+                           for entry in entries]
+                added = []
+                for i, task in enumerate(fetches):
+                    try:
+                        song_path, info = await task
+                    except Exception as ex:
+                        error_logger.error(f"Failed to download playlist entry {entries[i].get('url')}: {ex}")
+                        continue
+                    finally:
+                        next_fetch = i + 1
+                    try:
+                        song_title = await self.enqueue(ctx, song_path, info)
+                    except:
+                        # still holds its cache reference if it never made it into the queue
+                        self.audio_cache.release(info.pop("cache_key", None))
+                        raise
+                    if song_title is None:
+                        return await ctx.send("Bot left vc before the playlist could be added.")
+                    added.append(song_title)
+                    await m.edit(content=f"✅ Added `{song_title}` to queue. "
+                                         f"({i + 1}/{len(entries)})".replace('@', '@\u200b'))
+                if not added:
+                    raise Exception("Nothing could be downloaded")
 
             except Exception as ex:
+                error_logger.error(f"❌ Failed to add `{query}` playlist to queue: {ex}")
                 await m.edit(content=f"❌ Failed to add `{query}` playlist to queue.".replace('@', '@\u200b'))
-                print(ex)
+            finally:
+                await self.release_fetches(fetches[next_fetch:])
+
+    async def release_fetches(self, fetches):
+        """
+        Wait for playlist downloads that won't be queued anymore (they can't be stopped
+        once they started) and drop the cache references of the ones that succeeded
+        """
+        for fetched in await asyncio.gather(*fetches, return_exceptions=True):
+            if not isinstance(fetched, BaseException):
+                self.audio_cache.release(fetched[1].get("cache_key"))
 
     @commands.command(aliases=['que'])
     async def queue(self, ctx):
@@ -425,6 +548,7 @@ class Music(commands.Cog):
             return
 
         self.voice_clients[ctx.guild.id].stop()
+        self.release_songs(self.queues.pop(ctx.guild.id, []))
         self.queues[ctx.guild.id] = []
         await self.voice_clients[ctx.guild.id].disconnect()
         self.voice_clients.pop(ctx.guild.id, None)
@@ -555,6 +679,13 @@ class Music(commands.Cog):
 
         await ctx.send(embed=embed)
 
+    @commands.check(checks.owner_check)
+    @commands.command(hidden=True)
+    async def musiccache(self, ctx):
+        """Audio cache size, hit rate and evictions"""
+        await ctx.send(f'```{self.audio_cache.format()}\n'
+                       f'loudness: hits={self.loudness.hits} misses={self.loudness.misses}```')
+
     def create_progress_bar(self, progress, total, length):
         filled_length = int(length * progress // total)
         bar = '▰' * filled_length + '▱' * (length - filled_length)
@@ -566,35 +697,18 @@ class Music(commands.Cog):
         if member.id == self.bot.user.id and before.channel and not after.channel:
             guild_id = before.channel.guild.id
             # Clear the queue and song info for the guild
-            self.queues.pop(guild_id, None)
+            self.release_songs(self.queues.pop(guild_id, []))
 
     async def adjust_volume(self, audio):
-        def get_audio_change(audio):
-            try:
-                maxpeak, maxmean = -1, -12.0  # people can adjust the volume on their own on the actual bot
-                findaudiomean = re.compile(
-                    r"\[Parsed_volumedetect_\d+ @ [0-9a-zA-Z]+\] " + r"mean_volume: (\-?\d+\.\d) dB")
-                findaudiopeak = re.compile(
-                    r"\[Parsed_volumedetect_\d+ @ [0-9a-zA-Z]+\] " + r"max_volume: (\-?\d+\.\d) dB")
-                audiochange, peak, mean = 0.0, 0.0, 0.0
-
-                while peak > maxpeak or mean > maxmean:
-                    command = f'ffmpeg -loglevel info -t 360 -i {audio} -vn -ac 2 -map 0:a:0 -af ' \
-                              f'"volume={audiochange}dB:precision=fixed,volumedetect" -sn ' \
-                              f'-hide_banner -nostats -max_muxing_queue_size 4096 -f null -'
-                    process = subprocess.run(command, stderr=subprocess.PIPE, shell=True)
-                    string = str(process.stderr.decode())
-                    mean, peak = float(findaudiomean.search(string).group(1)), float(
-                        findaudiopeak.search(string).group(1))
-                    audiochange += -10.0 if peak == 0.0 else min(maxpeak - peak, maxmean - mean)
-
-                return round(audiochange, 1)  # .1 precision
-            except Exception as ex:
-                error_logger.error(f"Exception in adjust_volume: {ex} | {traceback.print_exc()}")
-                return 0
-
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, get_audio_change, audio)
+        """
+        :param audio: path to the downloaded song
+        :return: gain in dB that normalizes its loudness, cached per file content, None if it failed
+        """
+        try:
+            return await get_pool('transcode').run(self.loudness.get_gain, audio)
+        except Exception as ex:
+            error_logger.error(f"Loudness analysis of {audio} couldn't run: {ex}")
+            return None
 
 
 async def setup(bot: commands.Bot):
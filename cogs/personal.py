@@ -87,9 +87,8 @@ class Personal(commands.Cog):
                         value=f'{"None" if not ps else ps[:-2]}')
 
         ack = ''
-        if ctx.guild.id in self.bot.from_serversetup and self.bot.from_serversetup[ctx.guild.id]['modrole']:
-            if self.bot.from_serversetup[ctx.guild.id]['modrole'] in [r.id for r in member.roles]:
-                ack = 'Moderator'
+        if checks.has_mod_role(self.bot, member, ctx.guild.id):
+            ack = 'Moderator'
         if gp.administrator: ack = 'Administrator'
         if member.id == ctx.guild.owner_id: ack = 'Owner'
         if ack:
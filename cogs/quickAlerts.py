@@ -9,8 +9,10 @@ from discord.ext import commands
 import utils.checks as checks
 import utils.discordUtils as dutils
 import utils.timeStuff as tutils
+from utils.database import run_db
 
 from models.quickAlerts import QuickAlerts
+from models.quickAlerts import db as alerts_db
 from models.views import AlertSelectMenuView
 
 logger = logging.getLogger('info')
@@ -109,18 +111,17 @@ class QuickAlertsC(commands.Cog):
     async def create_new_alert(self, guild_id, event, msg, emoji, target, alert_role):
         message_str = await self.get_message_history_str(msg)
         embed = self.create_alert_embed(msg, event, message_str)
-        alert = QuickAlerts.create(
-            alerted_message_id=event.message_id,
-            alerted_message_ch_id=event.channel_id,
-            alerted_user_id=msg.author.id,
-            reportee_user_id=event.member.id,
-            target_embed_message_id=0,
-            status=0
-        )
+        alert = await run_db(alerts_db, QuickAlerts.create,
+                             alerted_message_id=event.message_id,
+                             alerted_message_ch_id=event.channel_id,
+                             alerted_user_id=msg.author.id,
+                             reportee_user_id=event.member.id,
+                             target_embed_message_id=0,
+                             status=0)
         view = AlertSelectMenuView(self.alerts_data, alert)
         alert_msg_sent = await target.send(content=f'{alert_role.mention}', embed=embed, view=view)
         alert.target_embed_message_id = alert_msg_sent.id
-        alert.save()
+        await run_db(alerts_db, alert.save)
 
     async def get_message_history_str(self, msg):
         messages = []
@@ -209,9 +210,9 @@ class QuickAlertsC(commands.Cog):
         guild_id = message.guild.id
         if guild_id not in self.alerts_data:
             return
-        alert = QuickAlerts.get_or_none(QuickAlerts.target_embed_message_id == message.id)
-        if alert:
-            alert.delete_instance()  # Delete the instance from the database
+        deleted = await run_db(alerts_db, QuickAlerts.delete().where(
+            QuickAlerts.target_embed_message_id == message.id).execute)
+        if deleted:
             logger.info(f"Alert with target_embed_message_id {message.id} deleted due to message deletion")
 
 
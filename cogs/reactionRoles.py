@@ -7,7 +7,9 @@ from discord.ext import commands
 
 import utils.checks as checks
 import utils.discordUtils as dutils
+from utils.database import run_db
 from models.reactionroles import ReactionRolesModel, RRManager
+from models.reactionroles import db as rr_db
 
 TEST_EMOTES_MSG_PENDING = "Testing emotes for the reactions. Status: Pending ❔"
 TEST_EMOTES_MSG_PASSED = "Testing emotes for the reactions. Status: Passed ✅"
@@ -39,11 +41,12 @@ class ReactionRoles(commands.Cog):
         except:
             return await ctx.send(f"❌ No message with that id found in the channel {ch.mention}")
 
-        reactionData = ReactionRolesModel.get_or_none(msgid=msgID)
+        reactionData = await run_db(rr_db, ReactionRolesModel.get_or_none, msgid=msgID)
         if reactionData:
             return await ctx.send("❌ This message has already been initialized")
 
-        ReactionRolesModel.insert(gid=ctx.guild.id, chid=channel.id, msgid=msgID, msg_link=msg.jump_url).execute()
+        await run_db(rr_db, ReactionRolesModel.insert(gid=ctx.guild.id, chid=channel.id, msgid=msgID,
+                                                      msg_link=msg.jump_url).execute)
 
         RRManager.add_or_update_rrs_bot(ctx.bot, ctx.guild.id, channel.id, msgID, msg.jump_url, [])
         await ctx.send(f"✅ Message with the id {msg.id} and in the "
@@ -1,8 +1,11 @@
 import asyncio
 import datetime
+import heapq
+import itertools
 import logging
+import time
 import traceback
-import dateutil.parser
+
 import discord
 from discord import Embed
 from discord.ext import commands
@@ -11,12 +14,26 @@ import utils.checks as checks
 import utils.discordUtils as dutils
 import utils.timeStuff as tutils
 from models.moderation import Reminderstbl, Timezones
+from models.moderation import db as moderation_db
 from models.serversetup import SSManager
 from utils.SimplePaginator import SimplePaginator
+from utils.database import run_db
 
 logger = logging.getLogger('info')
 error_logger = logging.getLogger('error')
 
+# timers expiring within this many days are kept in memory, the rest get loaded by the periodic reload
+TIMER_WINDOW_DAYS = 30
+# max timers fired concurrently in one go
+TIMER_BATCH_SIZE = 50
+# seconds to wait before dispatching again after an unexpected error
+DISPATCH_RETRY_DELAY = 5
+
+
+def to_utc(dt):
+    # Reminderstbl dates come back as naive utc datetimes
+    return dt.replace(tzinfo=datetime.timezone.utc)
+
 
 class Timer:
     def __init__(self, *, record: dict):
@@ -29,11 +46,17 @@ class Timer:
         self.expires: datetime.datetime = record['expires_on']
         self.executed_by: int = record['executed_by']
         self.executed_on: datetime.datetime = record['executed_on']
+        self.periodic: int = record.get('periodic', 0)
 
     def __str__(self) -> str:
         return f"Timer(id={self.id}, meta={self.meta}, guild={self.guild}, reason={self.reason}, " \
                f"user_id={self.user_id}, len_str={self.len_str}, expires={self.expires}, " \
-               f"executed_by={self.executed_by}, executed_on={self.executed_on})"
+               f"executed_by={self.executed_by}, executed_on={self.executed_on}, periodic={self.periodic})"
+
+    def next_period(self) -> "Timer":
+        nxt = Timer(record={**self.__dict__, 'expires_on': self.expires})
+        nxt.expires = self.expires + datetime.timedelta(seconds=self.periodic)
+        return nxt
 
     @classmethod
     def temporary(cls, *, expires: datetime.datetime, meta: str, guild: int, reason: str, user_id: int,
@@ -59,8 +82,11 @@ class Reminders(commands.Cog):
     ):
         self.bot = bot
         # Credit to RoboDanny for timeout code help
-        self._have_data = asyncio.Event(loop=bot.loop)
-        self._current_timer = None
+        self._have_data = asyncio.Event()
+        self._heap = []  # (expires timestamp, seq, Timer)
+        self._timers = {}  # id -> Timer, a heap entry whose timer isn't in here was cancelled
+        self._seq = itertools.count()
+        self._firing = set()  # ids popped from the heap that are still being executed
         self._task = self.bot.loop.create_task(self.dispatch_timers())
         self.tried_setup = False
 
@@ -137,46 +163,22 @@ class Reminders(commands.Cog):
 
         logger.info(f"Leaving execute_reminder for {timer}")
 
-    async def short_timer_optimisation(self, seconds, timer):
-        await asyncio.sleep(seconds)
-        if not self.bot.from_serversetup:
-            if not self.tried_setup:
-                await self.set_server_stuff()
-        await self.call_timer(timer)
-
     async def call_timer(self, timer: Timer):
         logger.info(f"Time to call timer {timer}")
+        self._firing.add(timer.id)
         try:
-            rm: Reminderstbl = Reminderstbl.get(Reminderstbl.id == timer.id)
-            try:
-                if type(rm.expires_on) == str:
-                    rm.expires_on = dateutil.parser.parse(rm.expires_on)
-                if type(rm.executed_on) == str:
-                    rm.executed_on = dateutil.parser.parse(rm.executed_on)
-                rm.expires_on = rm.expires_on.replace(tzinfo=datetime.timezone.utc)
-                rm.executed_on = rm.executed_on.replace(tzinfo=datetime.timezone.utc)
-            except Exception as ex:
-                error_logger.error(ex)
-            # this is only for some weird race conciditons
-
-            logger.info(f"Got reminder for timer: {rm}")
-            if timer.executed_on != rm.executed_on:
-                logger.info(f"Timer and rm was: timer.executed_on != rm.executed_on, cancellign task")
-                self._task.cancel()
-                self._task = self.bot.loop.create_task(self.dispatch_timers())
-                return
-            if rm.periodic != 0:
-                logger.info(f"RM is periodic, time to increment it again: {rm}")
-                rm.expires_on = rm.expires_on + datetime.timedelta(seconds=rm.periodic)
-                rm.save()
-                logger.info(f"Periodic RM incremented: {rm}")
-            else:
-                logger.info(f"Deleting non periodic reminder instance")
-                rm.delete_instance()
+            # the durable write doubles as the check that the row wasn't deleted/replaced meanwhile
+            still_there = await run_db(moderation_db, self._consume_timer, timer)
         except Exception as ex:
-            logger.error(f"Empty exception in call_timer, just returning {ex}")
-            return  # reminder should have been executed but it was deleted
-            # and no other reminders have been created during that time. Just return here.
+            error_logger.error(f"Failed to update the db for timer {timer}: {ex}")
+            return
+        finally:
+            self._firing.discard(timer.id)
+        if not still_there:
+            logger.info(f"Timer {timer} is no longer in the db, not executing it")
+            return
+        if timer.periodic:
+            self.schedule(timer.next_period())
         if not self.bot.from_serversetup:
             if not self.tried_setup:
                 await self.set_server_stuff()
@@ -184,85 +186,111 @@ class Reminders(commands.Cog):
         await self.execute_reminder(timer)
         logger.info(f"execute_reminder done inside call_timer {timer}")
 
+    @staticmethod
+    def _consume_timer(timer: Timer):
+        if timer.periodic:
+            return Reminderstbl.update(expires_on=timer.expires + datetime.timedelta(seconds=timer.periodic)).where(
+                Reminderstbl.id == timer.id).execute()
+        return Reminderstbl.delete().where(Reminderstbl.id == timer.id).execute()
+
+    def schedule(self, timer: Timer):
+        """Add (or replace, by id) a timer, anything past the loaded window is picked up by a later reload"""
+        if timer.expires > discord.utils.utcnow() + datetime.timedelta(days=TIMER_WINDOW_DAYS):
+            self.unschedule(timer.id)
+            return
+        self._timers[timer.id] = timer
+        heapq.heappush(self._heap, (timer.expires.timestamp(), next(self._seq), timer))
+        self._have_data.set()
+
+    def unschedule(self, *timer_ids):
+        # the heap entries are skipped once they come up (lazy deletion)
+        for tid in timer_ids:
+            self._timers.pop(tid, None)
+
+    def set_periodic(self, timer_id, seconds):
+        if timer_id in self._timers:
+            self._timers[timer_id].periodic = seconds
+
+    @staticmethod
+    def _load_window(days):
+        until = datetime.datetime.utcnow() + datetime.timedelta(days=days)
+        return [r for r in Reminderstbl.select().where(Reminderstbl.expires_on < until).dicts()]
+
+    async def load_timers(self):
+        """(Re)load everything that expires within TIMER_WINDOW_DAYS into the heap"""
+        records = await run_db(moderation_db, self._load_window, TIMER_WINDOW_DAYS)
+        timers = {}
+        for r in records:
+            if r['id'] in self._firing: continue
+            r['expires_on'] = to_utc(r['expires_on'])
+            r['executed_on'] = to_utc(r['executed_on'])
+            timers[r['id']] = Timer(record=r)
+        self._timers = timers
+        self._heap = [(t.expires.timestamp(), next(self._seq), t) for t in timers.values()]
+        heapq.heapify(self._heap)
+        self._have_data.set()
+        logger.info(f"Loaded {len(timers)} timers")
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < TIMER_BATCH_SIZE:
+            _, _, timer = heapq.heappop(self._heap)
+            if self._timers.get(timer.id) is not timer:
+                continue  # cancelled or rescheduled
+            del self._timers[timer.id]
+            due.append(timer)
+        return due
+
     async def dispatch_timers(self):
         if not self.bot.is_ready():
             await self.bot.wait_until_ready()
         logger.info("In dispatch timers")
-        try:
-            while not self.bot.is_closed():
-                logger.info("---Inside while not self.bot.is_closed():, time to wait for active timer")
-                timer = await self.wait_for_active_timers(days=30)
-                timer.expires = timer.expires.replace(tzinfo=datetime.timezone.utc)
-                logger.info(f"---Got active timer: {timer}")
-                self._current_timer = timer
-                now = discord.utils.utcnow()
-
-                logger.info(f"Timer checking if >= now: {timer}")
-                if timer.expires >= now:
-                    to_sleep = (timer.expires - now).total_seconds()
-                    await asyncio.sleep(to_sleep)
-
-                logger.info(f"running call_timer for: {timer} ")
-                await self.call_timer(timer)
-
-        except asyncio.CancelledError:
-            logger.info("In displatch timers: a timer with a shorter time has beeb found")
-            raise  # a timer with a shorter time has beeb found
-        except(OSError, discord.ConnectionClosed):
-            logger.info("In displatch timers: OSError, discord.ConnectionClosed")
-            self._task.cancel()
-            self._task = self.bot.loop.create_task(self.dispatch_timers())
-
-    @staticmethod
-    async def get_active_timer(days=7):
-        logger.info("Inside get_active_timer")
-        now = datetime.datetime.utcnow()
-        record = Reminderstbl.select().where(Reminderstbl.expires_on < (now + datetime.timedelta(days=days))).order_by(
-            +Reminderstbl.expires_on
-        ).limit(1)
-        if record:
-            logger.info("Found record...")
-            record_dict = record.dicts()[0]
-            logger.info(f"Original Record dict is: {record_dict}")
-            if type(record_dict['expires_on']) == str:
-                record_dict['expires_on'] = dateutil.parser.parse(record_dict['expires_on'])
-            if type(record_dict['executed_on']) == str:
-                record_dict['executed_on'] = dateutil.parser.parse(record_dict['executed_on'])
-
-            record_dict['expires_on'] = record_dict['expires_on'].replace(tzinfo=datetime.timezone.utc)
-            record_dict['executed_on'] = record_dict['executed_on'].replace(tzinfo=datetime.timezone.utc)
-            # record_dict['expires_on'] = record_dict['expires_on'].astimezone(datetime.timezone.utc)
-            # record_dict['executed_on'] = record_dict['executed_on'].astimezone(datetime.timezone.utc)
-            logger.info(f"New Record dict is {record_dict}")
-            tim = Timer(record=record_dict)
-            logger.info(f"returning timer made from record_dict: {tim}")
-            return tim
-        else:
-            logger.info("No record found, returning None in get_active_timer")
-            return None
-
-    async def wait_for_active_timers(self, days=7):
-        logger.info("Inside wait_for_active_timers")
-        timer = await self.get_active_timer(days=days)
-        logger.info(f"get_active_timer returned {timer}")
-        if timer is not None:
-            self._have_data.set()
-            return timer
-
+        loaded = False
+        while not self.bot.is_closed():
+            try:
+                if not loaded:
+                    await self.load_timers()
+                    loaded = True
+                await self._dispatch_next()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # never let the task die, reminders and unmutes would stop until a restart
+                error_logger.error(f"Timer dispatch failed, retrying in {DISPATCH_RETRY_DELAY}s: "
+                                   f"{traceback.format_exc()}")
+                await asyncio.sleep(DISPATCH_RETRY_DELAY)
+
+    async def _dispatch_next(self):
+        """Wait for the next due timer(s) and fire them"""
+        # drop cancelled entries from the top so the sleep is for a real timer
+        while self._heap and self._timers.get(self._heap[0][2].id) is not self._heap[0][2]:
+            heapq.heappop(self._heap)
         self._have_data.clear()
-        self._current_timer = None
-        await self._have_data.wait()
-        logger.info("_have_data was set (this is a print in wait_for_active_timers) ... running get_active_timer")
-        return await self.get_active_timer(days=days)
+        if not self._heap:
+            await self._have_data.wait()
+            return
+        delay = self._heap[0][0] - time.time()
+        if delay > 0:
+            try:
+                # woken up early if a new timer gets scheduled
+                await asyncio.wait_for(self._have_data.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            return
+        due = self._pop_due(time.time())
+        logger.info(f"Firing {len(due)} timers")
+        res = await asyncio.gather(*[self.call_timer(t) for t in due], return_exceptions=True)
+        for t, r in zip(due, res):
+            if isinstance(r, Exception):
+                trace = ''.join(traceback.format_exception(type(r), r, r.__traceback__))
+                error_logger.error(f"Timer {t} failed: {trace}")
 
     async def create_timer(self, *, expires_on, meta, gid, reason, uid, len_str, author_id, should_update=False):
         logger.info("Inside create_timer")
-        now = datetime.datetime.now(datetime.timezone.utc)
         max_datetime = datetime.datetime.max.replace(tzinfo=datetime.timezone.utc) - datetime.timedelta(days=1)
         if not expires_on:
             expires_on = max_datetime
-        expires_on = expires_on.replace(tzinfo=datetime.timezone.utc)  # line 210
-        delta = (expires_on - now).total_seconds()
+        expires_on = expires_on.replace(tzinfo=datetime.timezone.utc)
         timer = Timer.temporary(
             expires=expires_on,
             meta=meta,
@@ -271,73 +299,32 @@ class Reminders(commands.Cog):
             user_id=uid,
             len_str=len_str,
             executed_by=author_id,
-            executed_on=0  # tmp value
+            executed_on=discord.utils.utcnow()
         )
-        # Insert into REMINDERSTABLE here
-        try:
-            if not should_update:
-                raise
 
-            # due to race conditions with MUTE we check if it's still in the db
-            rem = Reminderstbl.get(Reminderstbl.guild == gid,
-                                   Reminderstbl.user_id == uid)
-            try:
-                if type(rem.expires_on) == str:
-                    rem.expires_on = dateutil.parser.parse(rem.expires_on)
-                if type(rem.executed_on) == str:
-                    rem.executed_on = dateutil.parser.parse(rem.executed_on)
-                rem.executed_on = rem.executed_on.replace(tzinfo=datetime.timezone.utc)
-                rem.expires_on = rem.expires_on.replace(tzinfo=datetime.timezone.utc)
-            except Exception as ex:
-                error_logger.error(ex)
-
-            rem.len_str = len_str
-            rem.expires_on = expires_on
-            rem.executed_by = author_id
-            rem.reason = reason
-            rem.save()
-            timer.id = rem.id
-            timer.executed_on = rem.executed_on
-        except:
+        def _save():
+            if should_update:
+                # due to race conditions with MUTE we check if it's still in the db
+                rem = Reminderstbl.get_or_none(Reminderstbl.guild == gid, Reminderstbl.user_id == uid)
+                if rem:
+                    Reminderstbl.update(len_str=len_str, expires_on=expires_on, executed_by=author_id,
+                                        reason=reason).where(Reminderstbl.id == rem.id).execute()
+                    return rem.id, to_utc(rem.executed_on)
             # Only insert if not exists (1 user mute per guild)
-            tim_id = Reminderstbl.insert(guild=gid, reason=reason, user_id=uid, len_str=len_str,
-                                         expires_on=expires_on, executed_by=author_id, meta=meta).execute()
-            timer.id = tim_id
-            timer.executed_on = (Reminderstbl.get_by_id(tim_id)).executed_on.replace(tzinfo=datetime.timezone.utc)
+            return Reminderstbl.insert(guild=gid, reason=reason, user_id=uid, len_str=len_str, meta=meta,
+                                       expires_on=expires_on, executed_by=author_id,
+                                       executed_on=timer.executed_on).execute(), timer.executed_on
 
+        timer.id, timer.executed_on = await run_db(moderation_db, _save)
         logger.info(f"Timer created: {timer}")
-        if delta <= 30:
-            logger.info(f"We in short timer optimisation")
-            self.bot.loop.create_task(self.short_timer_optimisation(delta, timer))
-            return timer
-
-        # only set the data check if it can be waited on
-        if delta <= (86400 * 40):  # 40 days
-            logger.info(f"Delta ({delta}) is less than 40 days!")
-            self._have_data.set()
-
-        # check if this timer is earlier than our currently run timer
-        # error_logger.error(f"self._current_timer {self._current_timer}")
-        # error_logger.error(f"expires_on {expires_on}")
-        # if self._current_timer:
-        #    error_logger.error(f"self._current_timer.expires {self._current_timer.expires}")
-        logger.info(f"Comparing self._current_timer: {self._current_timer} and "
-                    f"expires_on: {expires_on} and s._ct.exp")
-        if self._current_timer and expires_on < self._current_timer.expires:
-            # cancel the task and re-run it
-            logger.info("cancelling tasak and re-running it")
-            self._task.cancel()
-            self._task = self.bot.loop.create_task(self.dispatch_timers())
-
-        logger.info(f"Returning timer {timer}")
+        self.schedule(timer)
         return timer
 
     async def refresh_timers_after_a_while(self):
         await self.bot.wait_until_ready()
         while True:
             await asyncio.sleep(86400 * 5)  # every 5 days
-            self._task.cancel()
-            self._task = self.bot.loop.create_task(self.dispatch_timers())
+            await self.load_timers()
 
     @commands.cooldown(1, 4, commands.BucketType.user)
     @commands.command(aliases=['mutc', 'setmyutc'])
@@ -544,8 +531,8 @@ class Reminders(commands.Cog):
             d = Reminderstbl.delete().where(Reminderstbl.executed_by == ctx.author.id,
                                             Reminderstbl.meta.startswith('reminder_'),
                                             Reminderstbl.id << will_delete).execute()
+            self.unschedule(*will_delete)
             await ctx.send(f"Removed **{d}** reminder." if d == 1 else f"Removed **{d}** reminders.")
-            # check if this timer is earlier than our currently run timer
         else:
             await ctx.send("Cancelled.")
 
@@ -572,6 +559,7 @@ class Reminders(commands.Cog):
         if seconds < 60: return await ctx.send("Min periodic time is 60 seconds. Cancelling.")
         reminder.periodic = seconds
         reminder.save()
+        self.set_periodic(reminder.id, seconds)
         ss = tutils.convert_sec_to_smhd(seconds)
         await ctx.send(f"Reminder with the id **{reminder_id}** is going to be executed again "
                        f"every **{ss}** after the next scheduled execution happens.")
@@ -591,6 +579,7 @@ class Reminders(commands.Cog):
 
         d = Reminderstbl.delete().where(Reminderstbl.executed_by == ctx.author.id,
                                         Reminderstbl.meta.startswith('reminder_')).execute()
+        self.unschedule(*[r.id for r in reminders])
 
         await ctx.send(f"I've cleared all (**{d}**) of your reminders {ctx.author.mention}")
 
@@ -14,8 +14,9 @@ from discord.ext import commands, tasks
 import utils.checks as checks
 import utils.discordUtils as dutils
 import utils.timeStuff as tutils
+from utils.database import run_db
 from models.antiraid import ArGuild, ArManager
-from models.moderation import Blacklist, ModManager
+from models.antiraid import db as ar_db
 from models.serversetup import (Guild, WelcomeMsg, SSManager)
 
 logger = logging.getLogger('info')
@@ -37,9 +38,13 @@ class Serversetup(commands.Cog):
         self.welcomed_in_guild = {}
 
     async def set_setup(self, gid=None):
+        """Rebuild the setup cache for gid only, or for every guild if it's None"""
         if not self.bot.is_ready():
             await self.bot.wait_until_ready()
-        self.bot.from_serversetup = await SSManager.get_setup_formatted(self.bot)
+        if gid:
+            await SSManager.refresh_guild(self.bot, gid)
+        else:
+            self.bot.from_serversetup = await SSManager.get_setup_formatted(self.bot)
 
     @commands.check(checks.admin_check)
     @commands.group(aliases=["sup"])
@@ -58,7 +63,7 @@ class Serversetup(commands.Cog):
         em = Embed(title="Current setup", color=ctx.bot.config['BOT_DEFAULT_EMBED_COLOR'])
         if hasattr(ctx.bot, 'from_serversetup') and (ctx.guild.id not in ctx.bot.from_serversetup):
             if self.tryParseOnce < 1:
-                ctx.bot.from_serversetup = await SSManager.get_setup_formatted(self.bot)
+                await SSManager.refresh_guild(self.bot, ctx.guild.id)
                 self.tryParseOnce += 1
                 return await ctx.reinvoke(restart=True)
 
@@ -916,7 +921,7 @@ class Serversetup(commands.Cog):
         """Display all current information regarding welcome messages"""
         if hasattr(ctx.bot, 'from_serversetup') and ('welcomemsg' not in ctx.bot.from_serversetup):
             if self.tryParseOnce < 1:
-                ctx.bot.from_serversetup = await SSManager.get_setup_formatted(self.bot)
+                await SSManager.refresh_guild(self.bot, ctx.guild.id)
                 self.tryParseOnce += 1
                 return await ctx.reinvoke(restart=True)
         try:
@@ -973,19 +978,17 @@ class Serversetup(commands.Cog):
 
     @commands.Cog.listener()
     async def on_member_join(self, member):
-        if -1 in self.bot.moderation_blacklist:
-            self.bot.moderation_blacklist = ModManager.return_blacklist_lists()
         smb = self.bot.moderation_blacklist
+        await smb.ensure_loaded()
         do_wel_msg = True
-        if member.guild.id in smb and member.id in smb[member.guild.id]:
+        if smb.contains(member.guild.id, member.id):
             try:
                 self.bot.banned_cuz_blacklist[f'{member.id}_{member.guild.id}'] = 2
                 await member.ban(reason="User joined when they were blacklisted. Removed the user from "
                                         "the datbase blacklist", delete_message_seconds=0)
-                Blacklist.delete().where(Blacklist.user_id == member.id, Blacklist.guild == member.guild.id).execute()
-                self.bot.moderation_blacklist = ModManager.return_blacklist_lists()
+                smb.remove(member.guild.id, [member.id])
             except:
-                self.bot.moderation_blacklist = ModManager.return_blacklist_lists()
+                pass
             do_wel_msg = False
 
         if do_wel_msg:
@@ -1102,10 +1105,26 @@ class Serversetup(commands.Cog):
 
     @commands.Cog.listener()
     async def on_webhooks_update(self, channel):
+        SSManager.invalidate_guild(self.bot, channel.guild.id)
         await self.set_setup(channel.guild.id)
 
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if before.roles != after.roles:
+            checks.forget_member_roles(after.guild.id, after.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        checks.forget_guild_roles(guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        # a deleted mod role can stay in the setup, members that only had it aren't mods anymore
+        checks.forget_guild_roles(role.guild.id)
+
     @commands.Cog.listener()
     async def on_member_remove(self, member):
+        checks.forget_member_roles(member.guild.id, member.id)
         if self.bot.banned_cuz_blacklist and f'{member.id}_{member.guild.id}' in self.bot.banned_cuz_blacklist:
             self.bot.banned_cuz_blacklist[f'{member.id}_{member.guild.id}'] -= \
                 self.bot.banned_cuz_blacklist[f'{member.id}_{member.guild.id}']
@@ -1193,13 +1212,11 @@ class Serversetup(commands.Cog):
                 before.guild.id not in self.bot.from_serversetup:
             return
         is_mod = await checks.moderator_check_no_ctx(after.author, after.guild, self.bot)
-        ck = 'censor_list'
+        ck = 'censor_matcher'
         if not is_mod:
             if after.guild and after.guild.id in self.bot.from_serversetup and \
                     self.bot.from_serversetup[after.guild.id][ck]:
-                if any(w in self.bot.from_serversetup[after.guild.id][ck] for w in after.content.split()):
-                    return await after.delete()
-                if any(c in after.content for c in self.bot.from_serversetup[after.guild.id][ck]):
+                if self.bot.from_serversetup[after.guild.id][ck].match(after.content):
                     return await after.delete()
         if str(before.channel.id) in self.bot.from_serversetup[before.guild.id]['ignored_chs_at_log']: return
         try:
@@ -1370,7 +1387,7 @@ class Serversetup(commands.Cog):
         pl = {0: '✅', 1: '⚠', 2: '🔥', 3: '💥'}
         arl = 0
         try:
-            db_guild = ArGuild.get(ArGuild.id == ctx.guild.id)
+            db_guild = await run_db(ar_db, ArGuild.get, ArGuild.id == ctx.guild.id)
             arl = db_guild.anti_raid_level
         except:
             pass
@@ -1379,16 +1396,20 @@ class Serversetup(commands.Cog):
         if anti_raid_level < 0: return await ctx.send("Min level is 0")
         if max_allowed_mentions < 0: return await ctx.send("Min max_allowed_mentions is 1")
         # chs = " ".join([str(c.id) for c in channels_to_ignore_for_mention_punishing])
-        try:
-            db_guild = ArGuild.get(ArGuild.id == ctx.guild.id)
-            db_guild.anti_raid_level = anti_raid_level
-            db_guild.max_allowed_mentions = max_allowed_mentions
-            db_guild.save()
-        except:
-            db_guild = ArGuild.create(id=ctx.guild.id,
+        def _save_level():
+            try:
+                g = ArGuild.get(ArGuild.id == ctx.guild.id)
+                g.anti_raid_level = anti_raid_level
+                g.max_allowed_mentions = max_allowed_mentions
+                g.save()
+                return g
+            except:
+                return ArGuild.create(id=ctx.guild.id,
                                       anti_raid_level=anti_raid_level,
                                       max_allowed_mentions=max_allowed_mentions)
-        ctx.bot.anti_raid = ArManager.get_ar_data()
+
+        db_guild = await run_db(ar_db, _save_level)
+        ctx.bot.anti_raid = await run_db(ar_db, ArManager.get_ar_data)
         # if chs: chs = '\n' + '\n'.join([c.mention for c in channels_to_ignore_for_mention_punishing])
         await ctx.send(f"Protection level: **{anti_raid_level}** {pl[anti_raid_level]}")
         m = None
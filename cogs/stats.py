@@ -14,7 +14,9 @@ from discord.ext import commands
 import utils.checks as checks
 import utils.discordUtils as dutils
 import utils.timeStuff as tutils
-from models.bot import BotBlacklist, BotBanlist
+from utils.database import get_stats, maintenance
+from utils.executors import format_pools
+from utils.http import http
 
 
 class Stats(commands.Cog):
@@ -243,6 +245,65 @@ class Stats(commands.Cog):
                                    color=ctx.bot.config['BOT_DEFAULT_EMBED_COLOR'])
                        .set_author(icon_url=ic, name="Comand statistics"))
 
+    @commands.command(aliases=['dbs'])
+    @commands.check(checks.owner_check)
+    async def dbstats(self, ctx):
+        """Shows query latency per database file (only queries ran through the db workers).
+        This is only for the current session.
+        """
+        stats = get_stats()
+        if not stats:
+            return await ctx.send("No database queries ran yet")
+        em = Embed(title="Database latency", color=ctx.bot.config['BOT_DEFAULT_EMBED_COLOR'])
+        for name, s in sorted(stats.items()):
+            em.add_field(name=name, value=f'```{s.format()}```', inline=False)
+        await ctx.send(embed=em)
+
+    @commands.command(aliases=['lgs'])
+    @commands.check(checks.owner_check)
+    async def logstats(self, ctx):
+        """Shows the log sink queue depth, drops and flush latency for the current session."""
+        sink = getattr(ctx.bot, 'log_sink', None)
+        if not sink:
+            return await ctx.send("Nothing was logged yet")
+        em = Embed(title="Log sink", description=f'```{sink.format()}```',
+                   color=ctx.bot.config['BOT_DEFAULT_EMBED_COLOR'])
+        await ctx.send(embed=em)
+
+    @commands.command(aliases=['pls'])
+    @commands.check(checks.owner_check)
+    async def poolstats(self, ctx):
+        """Shows queue depth and wait/run times of the media/network executors for the current session."""
+        em = Embed(title="Executors", description=f'```{format_pools()}```',
+                   color=ctx.bot.config['BOT_DEFAULT_EMBED_COLOR'])
+        await ctx.send(embed=em)
+
+    @commands.command(aliases=['hts'])
+    @commands.check(checks.owner_check)
+    async def httpstats(self, ctx):
+        """Shows the shared http client's request counts, pool usage and latency for the current session."""
+        em = Embed(title="HTTP client", description=f'```{http.format()}```',
+                   color=ctx.bot.config['BOT_DEFAULT_EMBED_COLOR'])
+        await ctx.send(embed=em)
+
+    @commands.max_concurrency(1)
+    @commands.command(aliases=['dbm'])
+    @commands.check(checks.owner_check)
+    async def dbmaintenance(self, ctx, action="checkpoint"):
+        """Run maintenance on all bot databases.
+
+        `[p]dbmaintenance checkpoint` - flush the WAL files into the databases
+        `[p]dbmaintenance vacuum` - rebuild the databases to reclaim free space (slow)
+        `[p]dbmaintenance optimize` - refresh the query planner statistics
+        """
+        if action not in ['checkpoint', 'vacuum', 'optimize']:
+            raise commands.errors.BadArgument
+        async with ctx.typing():
+            res = await maintenance(action)
+        output = '\n'.join(f'{k}: {v}' for k, v in sorted(res.items()))
+        await ctx.send(embed=Embed(title=f"Database {action}", description=f'```{output or "No databases"}```',
+                                   color=ctx.bot.config['BOT_DEFAULT_EMBED_COLOR']))
+
     @commands.command(aliases=['bb'], hidden=True)
     @commands.check(checks.owner_check)
     async def lsbotblacklist(self, ctx, limit=20):
@@ -268,8 +329,7 @@ class Stats(commands.Cog):
     async def unblacklistme(self, ctx):
         """Remove yourself from the blacklist"""
         if ctx.author.id in ctx.bot.blacklist:
-            BotBlacklist.delete().where(BotBlacklist.user == ctx.author.id).execute()
-            del ctx.bot.blacklist[ctx.author.id]
+            ctx.bot.blacklist.remove(ctx.author.id)
             await ctx.send("\N{WHITE HEAVY CHECK MARK} You have "
                            "been removed from the blacklist.")
         else:
@@ -282,10 +342,7 @@ class Stats(commands.Cog):
         """Unblacklist user by id [Admin only]"""
         ret = ''
         for user_id in user_ids:
-            if user_id in ctx.bot.blacklist:
-                del ctx.bot.blacklist[user_id]
-                BotBlacklist.delete().where(BotBlacklist.user == user_id).execute()
-            else:
+            if not ctx.bot.blacklist.remove(user_id):
                 ret += f"{user_id} is not blacklisted from the bot.\n"
         await ctx.send("Done." if not ret else ret + 'Done.')
 
@@ -295,10 +352,7 @@ class Stats(commands.Cog):
         """Unban user by id [Admin only]"""
         ret = ''
         for user_id in user_ids:
-            if user_id in ctx.bot.banlist:
-                del ctx.bot.banlist[user_id]
-                BotBanlist.delete().where(BotBanlist.user == user_id).execute()
-            else:
+            if not ctx.bot.banlist.remove(user_id):
                 ret += f"{user_id} is not banned from the bot.\n"
         await ctx.send("Done." if not ret else ret + '\nDone.')
 
@@ -323,13 +377,8 @@ async def setup(
     # Triggering the rate limit 5 times in a row will auto-ban the user from the bot.
     bot._auto_spam_count = Counter()
 
-    bot.blacklist = {}
-    bs = [q for q in BotBlacklist.select().dicts()]
-    for b in bs:  bot.blacklist[b['user']] = b['meta']
-
-    bot.banlist = {}
-    bs = [q for q in BotBanlist.select().dicts()]
-    for b in bs:  bot.banlist[b['user']] = b['meta']
+    await bot.blacklist.ensure_loaded()
+    await bot.banlist.ensure_loaded()
 
     ext = Stats(bot)
     await bot.add_cog(ext)
@@ -3,7 +3,6 @@ import datetime
 import logging
 import logging.handlers as handlers
 import os
-import re
 import subprocess
 import sys
 import time
@@ -15,12 +14,17 @@ from discord import Embed, Client, Reaction, VoiceClient, app_commands, Activity
 from discord.ext import commands
 
 import utils.discordUtils as dutils
-from models.afking import AfkManager
 from models.antiraid import ArManager
+from models.bot import BotBlacklist, BotBanlist
 from models.reactionroles import RRManager
 from utils.checks import owner_check, admin_check, moderator_check_no_ctx
+from utils.blacklists import BotUserList, GuildBlacklist, flush_all_sync
+from utils.config import config
 from utils.dataIOa import dataIOa
+from utils.executors import shutdown_pools
 from utils.help import Help
+from utils.http import http
+from utils.migrations import run_migrations
 
 formatter = logging.Formatter('%(asctime)s - %(threadName)s - %(name)s - %(levelname)s - %(message)s')
 if not os.path.exists("logs"):
@@ -58,15 +62,12 @@ intents.members = True
 intents.presences = True
 intents.message_content = True
 
-Prefix = dataIOa.load_json('config.json')['BOT_PREFIX']
-Prefix_Per_Guild = dataIOa.load_json('config.json')['B_PREF_GUILD']
+run_migrations()
 
 
 def get_pre(_bot, _message):
-    if isinstance(_message.channel, discord.DMChannel): return Prefix
-    gid = str(_message.guild.id)
-    if gid not in Prefix_Per_Guild: return Prefix
-    return Prefix_Per_Guild[gid]
+    if _message.guild is None: return config.prefix
+    return config.prefix_for(_message.guild.id)
 
 
 def get_pre_or_mention(_bot, _message):
@@ -83,12 +84,13 @@ bot.from_serversetup = {}
 bot.running_chapters = {}
 bot.chapters_json = {}
 bot.anti_raid = ArManager.get_ar_data()
-bot.currently_afk = AfkManager.return_whole_afk_list()
-bot.moderation_blacklist = {-1: 'dummy'}
+bot.currently_afk = {}
+bot.moderation_blacklist = GuildBlacklist()
+bot.blacklist = BotUserList(BotBlacklist)
+bot.banlist = BotUserList(BotBanlist)
 bot.reaction_roles = RRManager.return_whole_rr_list()
 ###
-bot.config = dataIOa.load_json('config.json')
-bot.config['BOT_DEFAULT_EMBED_COLOR'] = int(f"0x{bot.config['BOT_DEFAULT_EMBED_COLOR_STR'][-6:]}", 16)
+bot.config = config.data
 bot.help_command = Help()
 bot.before_run_cmd = 0
 bot.just_banned_by_bot = {}
@@ -121,12 +123,10 @@ async def on_ready():
     if hasattr(bot, 'running_chapters') and not bot.from_serversetup: bot.running_chapters = {}
     if hasattr(bot, 'chapters_json') and not bot.from_serversetup: bot.chapters_json = {}
     if hasattr(bot, 'anti_raid') and not bot.anti_raid: bot.anti_raid = ArManager.get_ar_data()
-    if hasattr(bot, 'currently_afk') and not bot.currently_afk: bot.currently_afk = AfkManager.return_whole_afk_list()
-    if hasattr(bot, 'moderation_blacklist') and not bot.moderation_blacklist: bot.moderation_blacklist = {-1: 'dummy'}
+    if not hasattr(bot, 'currently_afk'): bot.currently_afk = {}
     if hasattr(bot, 'reaction_roles') and not bot.reaction_roles: bot.reaction_roles = RRManager.return_whole_rr_list()
     ###
-    bot.config = dataIOa.load_json('config.json')
-    bot.config['BOT_DEFAULT_EMBED_COLOR'] = int(f"0x{bot.config['BOT_DEFAULT_EMBED_COLOR_STR'][-6:]}", 16)
+    bot.config = config.data
     bot.uptime = datetime.datetime.utcnow()
     # bot.ranCommands = 0
     bot.help_command = Help()
@@ -154,8 +154,6 @@ async def on_ready():
     if os.name != 'nt':
         os.setpgrp()
 
-    config = dataIOa.load_json("config.json")
-
     # Temporarily adding manga and bets only to ai bot ~~and dev bot~~
     # if config['CLIENT_ID'] in [705157369130123346, 589921811349635072]:
     #     await bot.load_extension("cogs.manga")
@@ -176,7 +174,7 @@ async def on_ready():
 #                 await message.delete()
 
 
-def exit_bot(self):
+async def exit_bot(self):
     # if os.name != 'nt': In case you need to kill some other tasks
     #     try:
     #         os.killpg(0, signal.SIGKILL)
@@ -191,6 +189,13 @@ def exit_bot(self):
             t.cancel()
         except:
             pass
+    if hasattr(bot, 'log_sink'):
+        await bot.log_sink.close()
+    await http.close()
+    shutdown_pools(wait=False)
+    # os._exit skips atexit, so write out pending write-behind json and blacklist changes here
+    dataIOa.flush()
+    flush_all_sync()
     os._exit(0)
 
 
@@ -275,15 +280,7 @@ async def prefix(ctx, *, new_prefix=""):
         "as the previous one? Oh yeah, if you are trying to make a prefix"
         "with a space at the end, for example `bb command` then do: "
         "`.prefix bb{space_here}`")
-    ctx.bot.config['B_PREF_GUILD'][str(ctx.guild.id)] = new_prefix
-    if new_prefix == Prefix: del ctx.bot.config['B_PREF_GUILD'][str(ctx.guild.id)]
-    conf_copy = bot.config.copy()
-    conf_copy["BOT_DM_LOG"]["CAN_SEND"] = 0
-    conf_copy["BOT_DM_LOG"]["HOOK"] = 0
-    conf_copy['BOT_DEFAULT_EMBED_COLOR'] = 0
-    dataIOa.save_json("config.json", conf_copy)
-    global Prefix_Per_Guild
-    Prefix_Per_Guild = ctx.bot.config['B_PREF_GUILD']
+    config.set_guild_prefix(ctx.guild.id, new_prefix)
     await ctx.send("Prefix changed.")
 
 
@@ -306,14 +303,7 @@ async def globalprefix(ctx, *, new_prefix=""):
         "as the previous one? Oh yeah, if you are trying to make a prefix"
         "with a space at the end, for example `bb command` then do: "
         "`.prefix bb{space_here}`")
-    bot.config['BOT_PREFIX'] = new_prefix
-    conf_copy = bot.config.copy()
-    conf_copy["BOT_DM_LOG"]["CAN_SEND"] = 0
-    conf_copy["BOT_DM_LOG"]["HOOK"] = 0
-    conf_copy['BOT_DEFAULT_EMBED_COLOR'] = 0
-    dataIOa.save_json("config.json", conf_copy)
-    global Prefix
-    Prefix = new_prefix
+    config.set('BOT_PREFIX', new_prefix)
     await ctx.send("Prefix changed.")
 
 
@@ -341,15 +331,11 @@ async def on_message(message):
                     pass
 
     is_mod = await moderator_check_no_ctx(message.author, message.guild, bot)
-    ck = 'censor_list'
+    ck = 'censor_matcher'
     was_deleted = False
     if not is_mod:
         if message.guild and message.guild.id in bot.from_serversetup and bot.from_serversetup[message.guild.id][ck]:
-            if any(w.lower() in bot.from_serversetup[message.guild.id][ck] for w in message.content.lower().split()):
-                await message.delete()
-                was_deleted = True
-            if any(c in message.content.lower() for c in
-                   bot.from_serversetup[message.guild.id][ck]) and not was_deleted:
+            if bot.from_serversetup[message.guild.id][ck].match(message.content):
                 await message.delete()
                 was_deleted = True
 
@@ -384,7 +370,7 @@ async def on_message(message):
     #  Check if it's actually a cmd or custom cmd
     possible_cmd = ""
     is_actually_cmd = False
-    ctype = -1  # 1 possible_cmd | 2 mutli word | 3 same as 0 but inh | 4 same as 1 but inh
+    custom_cmd = None
     if message.content.startswith(f'<@{bot.config["CLIENT_ID"]}>'):
         pfx_len = len(f'<@{bot.config["CLIENT_ID"]}>') + 1
     elif message.content.startswith(f'<@!{bot.config["CLIENT_ID"]}>'):
@@ -399,17 +385,15 @@ async def on_message(message):
             is_actually_cmd = True
         if not is_actually_cmd:
             if message.guild and message.guild.id in bot.all_cmds:
-                if possible_cmd in bot.all_cmds[message.guild.id]['cmds_name_list']:
-                    ctype = 1
-                elif message.content[pfx_len:] in bot.all_cmds[message.guild.id]['cmds_name_list']:
-                    ctype = 2
-                elif possible_cmd in bot.all_cmds[message.guild.id]['inh_cmds_name_list']:
-                    ctype = 3
-                elif message.content[pfx_len:] in bot.all_cmds[message.guild.id]['inh_cmds_name_list']:
-                    ctype = 4
+                own = bot.all_cmds[message.guild.id]['cmds']
+                dispatch = bot.all_cmds[message.guild.id]['dispatch']
+                full_cmd = message.content[pfx_len:]
+                # the guild's own commands (single or multi word) win over inherited ones
+                custom_cmd = own.get(possible_cmd) or own.get(full_cmd) or \
+                    dispatch.get(possible_cmd) or dispatch.get(full_cmd)
 
     # if it was a command
-    if (is_actually_cmd or ctype > 0) or arl > 1:  # catch messages here for anti spam on arl > 1 regardless of cmd
+    if (is_actually_cmd or custom_cmd) or arl > 1:  # catch messages here for anti spam on arl > 1 regardless of cmd
         if arl in [0, 1]:  # If not checking for message spamming and user is blacklisted return
             if message.author.id in bot.banlist:
                 return
@@ -474,7 +458,7 @@ async def on_message(message):
         if message.guild and message.guild.id in bot.from_serversetup and bot.from_serversetup[message.guild.id][kk]:
             sup = bot.from_serversetup[message.guild.id][kk]
 
-        if not is_mod and (is_actually_cmd or ctype > 0) and arl > 1:
+        if not is_mod and (is_actually_cmd or custom_cmd) and arl > 1:
             return  # we don't want non mods triggering commands during a raid
         if was_deleted:
             return
@@ -493,7 +477,7 @@ async def on_message(message):
                 return await message.channel.send("Bot is still starting up, hold on a few seconds.")
             return await bot.process_commands(message)
 
-        if ctype != -1:
+        if custom_cmd:
             if not bot.is_ready():
                 return await message.channel.send("Bot is still starting up, hold on a few seconds.")
             if arl == 1 and not is_mod:
@@ -508,27 +492,13 @@ async def on_message(message):
                     return await message.channel.send("❌ Custom commands are enabled only in the following channels:\n"
                                                       f"{', '.join((message.guild.get_channel(c)).mention for c in sup[pos_c]['only_e'])}")
 
-            if ctype == 1:
-                c = bot.all_cmds[message.guild.id]['cmds'][possible_cmd]
-            elif ctype == 2:
-                c = bot.all_cmds[message.guild.id]['cmds'][message.content[pfx_len:]]
-            elif ctype == 3:
-                for cc in bot.all_cmds[message.guild.id]['inh_cmd_list']:
-                    if possible_cmd in cc: c = cc[possible_cmd]
-            elif ctype == 4:
-                for cc in bot.all_cmds[message.guild.id]['inh_cmd_list']:
-                    if message.content[pfx_len:] in cc: c = cc[message.content[pfx_len:]]
-
-            if bool(c['raw']): return await message.channel.send(c['content'])
-            if bool(c['image']):
-                em = Embed(color=int(f'0x{c["color"][-6:]}', 16))
-                em.set_image(url=c['content'])
+            c = custom_cmd['compiled']
+            if c['raw']: return await message.channel.send(c['content'])
+            if c['image']:
+                em = Embed(color=c['color'])
             else:
-                em = Embed(color=int(f'0x{c["color"][-6:]}', 16), description=c['content'])
-                pic = str(c['content']).find('http')
-                if pic > -1:
-                    urls = re.findall(r'https?:[/.\w\s-]*\.(?:jpg|gif|png|jpeg)', str(c['content']))
-                    if len(urls) > 0: em.set_image(url=urls[0])
+                em = Embed(color=c['color'], description=c['content'])
+            if c['image_url']: em.set_image(url=c['image_url'])
             return await message.channel.send(embed=em)
 
 
@@ -565,7 +535,7 @@ async def restart(ctx, options: str = ""):
     await ctx.send("Restarting...")
     restarT = {"guild": ctx.guild.id, "channel": ctx.channel.id}
     dataIOa.save_json("restart.json", restarT)
-    exit_bot(0)
+    await exit_bot(0)
 
 
 @commands.max_concurrency(1)
@@ -577,7 +547,7 @@ async def shutdown(ctx):
         q.write('.')
     await ctx.send("Shut down.")
     logger.info("Shut down.")
-    exit_bot(0)
+    await exit_bot(0)
 
 
 @bot.event
@@ -651,7 +621,7 @@ async def on_error(event, *args, **kwargs):
         error_logger.error(f"---------- CRASHED ----------: {exc_type}")
         print("exception occurred, restarting...")
         error_logger.error("exception occurred, restarting bot")
-        exit_bot(0)
+        await exit_bot(0)
     else:
         # print(f'---{datetime.datetime.utcnow().strftime("%c")}---')
         trace = traceback.format_exc()
@@ -711,8 +681,7 @@ async def load_all_cogs_except(cogs_to_exclude):
 
 async def main() -> None:
     async with bot:
-        config = dataIOa.load_json("config.json")
-        token = config['BOT_TOKEN']
+        token = config.get_str('BOT_TOKEN')
 
         await bot.start(token=token)
 
@@ -1,13 +1,17 @@
 from peewee import *
 from datetime import datetime
 
+from utils.database import get_db, get_table_function, run_db
+from utils.migrations import migration
+
 DB = "data/afks.db"
-db = SqliteDatabase(DB, pragmas={'foreign_keys': 1})
+db = get_db(DB)
 
 
 class BaseModel(Model):
     class Meta:
         database = db
+        table_function = get_table_function(DB)
 
 
 class AfkTbl(BaseModel):
@@ -21,29 +25,56 @@ class AfkTbl(BaseModel):
 db.create_tables([AfkTbl])
 
 
+@migration(DB, 1, 'Unique (gid, uid) index on the afk table')
+def _afk_gid_uid_index(db):
+    table = AfkTbl._meta.table_name
+    with db.atomic():
+        # older rows could have duplicates, keep the newest one
+        db.execute_sql(f'DELETE FROM "{table}" WHERE id NOT IN (SELECT MAX(id) FROM "{table}" GROUP BY gid, uid)')
+        db.execute_sql(f'CREATE UNIQUE INDEX IF NOT EXISTS "{table}_gid_uid" ON "{table}" (gid, uid)')
+
+
 class AfkManager:
+    """
+    bot.currently_afk is {gid: {uid: [msg, afk_on]}}, a guild is only loaded in there
+    the first time it's needed (see get_guild_afks), so it doesn't grow with old rows
+    """
+
+    @staticmethod
+    def _load_guild(gid):
+        return {aa['uid']: [aa['msg'], aa['afk_on']]
+                for aa in AfkTbl.select(AfkTbl.uid, AfkTbl.msg, AfkTbl.afk_on).where(AfkTbl.gid == gid).dicts()}
+
+    @staticmethod
+    async def get_guild_afks(bot, gid):
+        """
+        :return: {uid: [msg, afk_on]} for the guild, loaded from the db on first use
+        """
+        if gid not in bot.currently_afk:
+            afks = await run_db(db, AfkManager._load_guild, gid)
+            # another message might've loaded it while this one was waiting
+            bot.currently_afk.setdefault(gid, afks)
+        return bot.currently_afk[gid]
+
     @staticmethod
-    def return_whole_afk_list():
-        afks = [q for q in AfkTbl.select().dicts()]
-        ret = {}
-        for aa in afks:
-            if aa['gid'] not in ret:
-                ret[aa['gid']] = {}
-            ret[aa['gid']][aa['uid']] = [aa['msg'], aa['afk_on']]
-        return ret
+    async def set_afk(bot, gid, uid, msg):
+        afks = await AfkManager.get_guild_afks(bot, gid)
+        afk_on = datetime.utcnow()
+        await run_db(db, AfkTbl.insert(gid=gid, uid=uid, msg=msg, afk_on=afk_on)
+                     .on_conflict(conflict_target=[AfkTbl.gid, AfkTbl.uid],
+                                  update={AfkTbl.msg: msg, AfkTbl.afk_on: afk_on}).execute)
+        afks[uid] = [msg, afk_on]
 
     @staticmethod
-    def set_new_bot_afk(bot, afk: AfkTbl):
-        if afk.gid not in bot.currently_afk:
-            bot.currently_afk[afk.gid] = {}
-        bot.currently_afk[afk.gid][afk.uid] = [afk.msg, afk.afk_on]
+    async def remove_from_afk(bot, uid, gid):
+        afks = await AfkManager.get_guild_afks(bot, gid)
+        if uid in afks:
+            try:
+                await run_db(db, AfkTbl.delete().where(AfkTbl.gid == gid, AfkTbl.uid == uid).execute)
+                del afks[uid]
+            except:
+                pass
 
     @staticmethod
-    def remove_from_afk(bot, uid, gid):
-        if gid in bot.currently_afk:
-            if uid in bot.currently_afk[gid]:
-                try:
-                    AfkTbl.delete().where(AfkTbl.uid == uid, AfkTbl.gid == gid).execute()
-                    del bot.currently_afk[gid][uid]
-                except:
-                    pass
+    def forget_guild(bot, gid):
+        bot.currently_afk.pop(gid, None)
@@ -1,15 +1,23 @@
 # cmdID cmdname, cnt, color, image, raw, created_on, author
 # guildID
+import re
+
 from peewee import *
 from datetime import datetime
 
+from utils.database import get_db, get_table_function
+
 DB = "data/cmds.db"
-db = SqliteDatabase(DB, pragmas={'foreign_keys': 1})
+db = get_db(DB)
+
+IMG_URL_RE = re.compile(r'https?:[/.\w\s-]*\.(?:jpg|gif|png|jpeg)')
+DEFAULT_CMD_COLOR = 0x4f545c
 
 
 class BaseModel(Model):
     class Meta:
         database = db
+        table_function = get_table_function(DB)
 
 
 class Guild(BaseModel):
@@ -63,22 +71,25 @@ class CmdsManager:
 
     @staticmethod
     def get_commands_formatted():
-        cursor = db.execute_sql("select * from (SELECT * from guild inner join commandstoguild c "
-                                "on guild.id = c.guild_id) as a inner join command cc on cc.id == a.command_id")
+        cursor = db.execute_sql(f"select * from (SELECT * from {Guild._meta.table_name} g "
+                                f"inner join {CommandsToGuild._meta.table_name} c on g.id = c.guild_id) as a "
+                                f"inner join {Command._meta.table_name} cc on cc.id == a.command_id")
         columns = [column[0] for column in cursor.description]
         res = [dict(zip(columns, row)) for row in cursor.fetchall()]
         ret = {}
         for row in res:
             if row['guild_id'] not in ret: ret[row['guild_id']] = {'inh_cmd_list': [], 'inh_cmd_gids': None,
                                                                    'cmds': {}, 'cmds_name_list': [],
-                                                                   'inh_cmds_name_list': []}
+                                                                   'inh_cmds_name_list': [], 'dispatch': {}}
+            row['compiled'] = CmdsManager.compile_cmd(row)
             ret[row['guild_id']]['cmds'][row['name']] = row
             if row['inherits_from']: ret[row['guild_id']]['inh_cmd_gids'] = row['inherits_from']
 
         for k, v in ret.items():
             if v['inh_cmd_gids']:
                 for gid in v['inh_cmd_gids'].split(' '):
-                    v['inh_cmd_list'].append(ret[int(gid)]['cmds'])
+                    if int(gid) in ret:
+                        v['inh_cmd_list'].append(ret[int(gid)]['cmds'])
             for kk, c in v['cmds'].items():
                 v['cmds_name_list'].append(kk)
 
@@ -86,4 +97,38 @@ class CmdsManager:
                 for cc in vv:
                     v['inh_cmds_name_list'].append(cc)
 
+            v['dispatch'] = CmdsManager.build_dispatch(v['cmds'], v['inh_cmd_list'])
+
+        return ret
+
+    @staticmethod
+    def compile_cmd(row):
+        """
+        Pre-parse what's needed to send the command so on_message doesn't have to
+        :return: {raw, image, content, color (int), image_url}
+        """
+        ret = {'raw': bool(row['raw']), 'image': bool(row['image']), 'content': row['content'],
+               'color': DEFAULT_CMD_COLOR, 'image_url': None}
+        if ret['raw']: return ret
+        try:
+            ret['color'] = int(f'0x{row["color"][-6:]}', 16)
+        except:
+            pass
+        if ret['image']:
+            ret['image_url'] = row['content']
+        elif 'http' in str(row['content']):
+            urls = IMG_URL_RE.findall(str(row['content']))
+            if len(urls) > 0: ret['image_url'] = urls[0]
+        return ret
+
+    @staticmethod
+    def build_dispatch(cmds, inh_cmd_list):
+        """
+        Merge the guild's own and inherited commands into a single name -> command dict
+        Later inherited guilds override earlier ones and the guild's own commands override all of them
+        """
+        ret = {}
+        for inh in inh_cmd_list:
+            ret.update(inh)
+        ret.update(cmds)
         return ret
@@ -1,13 +1,16 @@
 from peewee import *
 from datetime import datetime
 
+from utils.database import get_db, get_table_function
+
 DB = "data/manga.db"
-db = SqliteDatabase(DB, pragmas={'foreign_keys': 1})
+db = get_db(DB)
 
 
 class BaseModel(Model):
     class Meta:
         database = db
+        table_function = get_table_function(DB)
 
 
 class Tbd(BaseModel):
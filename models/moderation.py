@@ -4,31 +4,49 @@ Actions: id, guild, reason, type, date, channel, msg_jump
 responsible, offender
 """
 
+import calendar
+import logging
+
+import dateutil.parser
 from peewee import *
 from datetime import datetime
 
+from utils.database import get_db, get_table_function
+from utils.migrations import add_column, migration
+
+error_logger = logging.getLogger('error')
+
 DB = "data/moderation.db"
-db = SqliteDatabase(DB, pragmas={'foreign_keys': 1})
+db = get_db(DB)
 
 
 class BaseModel(Model):
     class Meta:
         database = db
+        table_function = get_table_function(DB)
 
 
 class Reminderstbl(BaseModel):
     id = AutoField()
     meta = CharField()
-    expires_on = DateTimeField()
+    # stored as utc epoch seconds, read back as naive utc datetimes
+    expires_on = TimestampField(utc=True)
     executed_by = IntegerField(null=True)
     guild = IntegerField(null=True)
     reason = CharField(null=True)
     # basically target_id is "user_id"
     user_id = IntegerField(null=True)
     len_str = CharField(null=True)
-    executed_on = DateTimeField(default=datetime.utcnow)
+    executed_on = TimestampField(utc=True, default=datetime.utcnow)
     periodic = IntegerField(default=0)
 
+    class Meta:
+        indexes = (
+            (('expires_on',), False),
+            (('guild', 'user_id'), False),
+        )
+
+
 class Actions(BaseModel):
     id = AutoField()
     case_id_on_g = IntegerField(default=-1)
@@ -44,6 +62,15 @@ class Actions(BaseModel):
     jump_url = CharField()
     logged_after = DateTimeField(null=True)
     logged_in_ch = IntegerField(null=True)
+    # modlog message (and the webhook that sent it, if any) so the case can be edited by id
+    logged_msg_id = IntegerField(null=True)
+    logged_hook_id = IntegerField(null=True)
+
+    class Meta:
+        indexes = (
+            (('guild', 'case_id_on_g'), False),
+            (('guild', 'type', 'offender'), False),
+        )
 
 
 class Blacklist(BaseModel):
@@ -59,19 +86,57 @@ class Timezones(BaseModel):
 db.create_tables([Reminderstbl, Actions, Blacklist, Timezones])
 
 
+def _to_epoch(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    dt = dateutil.parser.parse(value)
+    # naive values were always utc
+    return calendar.timegm(dt.utctimetuple())
+
+
+@migration(DB, 1, 'Reminder dates as epoch integers')
+def _reminders_epoch_dates(db):
+    table = Reminderstbl._meta.table_name
+    rows = db.execute_sql(f'SELECT id, expires_on, executed_on FROM "{table}" '
+                          f'WHERE typeof(expires_on) = \'text\' OR typeof(executed_on) = \'text\'').fetchall()
+    with db.atomic():
+        for rid, expires_on, executed_on in rows:
+            try:
+                db.execute_sql(f'UPDATE "{table}" SET expires_on = ?, executed_on = ? WHERE id = ?',
+                               (_to_epoch(expires_on), _to_epoch(executed_on), rid))
+            except (ValueError, OverflowError):
+                # the old code couldn't have executed this one either
+                error_logger.error(f'Dropping reminder {rid} with unparsable dates {expires_on} / {executed_on}')
+                db.execute_sql(f'DELETE FROM "{table}" WHERE id = ?', (rid,))
+
+
+@migration(DB, 2, 'Modlog message and webhook ids on actions')
+def _actions_logged_msg(db):
+    table = Actions._meta.table_name
+    add_column(db, table, 'logged_msg_id', 'INTEGER')
+    add_column(db, table, 'logged_hook_id', 'INTEGER')
+
+
+# gid -> last case id handed out, seeded from MAX(case_id_on_g) on first use
+_last_case_ids = {}
+
+
 class ModManager:
     @staticmethod
     def get_expired_mutes(gid):
         pass
 
     @staticmethod
-    def return_blacklist_lists():
-        bs = [q for q in Blacklist.select().dicts()]
-        ret = {}
-        for b in bs:
-            if b['guild'] not in ret:
-                ret[b['guild']] = []
-            ret[b['guild']].append(int(b['user_id']))
-        for k, v in ret.items():
-            ret[k] = list(set(v))
-        return ret
+    def insert_action(gid, **fields):
+        """
+        Insert a mod action with the guild's next case id, has to run on the db's
+        worker thread (run_db) which is what keeps the counter race free
+        :return: the case id
+        """
+        if gid not in _last_case_ids:
+            _last_case_ids[gid] = Actions.select(fn.MAX(Actions.case_id_on_g)).where(
+                Actions.guild == gid).scalar() or 0
+        case_id = _last_case_ids[gid] + 1
+        Actions.insert(guild=gid, case_id_on_g=case_id, **fields).execute()
+        _last_case_ids[gid] = case_id
+        return case_id
@@ -3,17 +3,21 @@ import os
 import re
 
 from PIL import Image
-import aiohttp
 from peewee import *
 from datetime import datetime
 
+from utils.database import get_db, get_table_function
+from utils.executors import get_pool
+from utils.http import http
+
 DB = "data/prs.db"
-db = SqliteDatabase(DB, pragmas={'foreign_keys': 1})
+db = get_db(DB)
 
 
 class BaseModel(Model):
     class Meta:
         database = db
+        table_function = get_table_function(DB)
 
 
 class PRMembers(BaseModel):
@@ -29,27 +33,8 @@ class PRMembers(BaseModel):
 db.create_tables([PRMembers])
 
 
-async def verify_and_save_avatar(url, subfolder, name):
-    ava_tmp_folder = f'tmp/pr_avatars/{subfolder}'
-    ava_main_folder = f'data/pr_avatars/{subfolder}'
-    os.makedirs(ava_tmp_folder, exist_ok=True)
-    os.makedirs(ava_main_folder, exist_ok=True)
-    url2 = url.split('?')[::-1][-1]
-    ava_tmp_path = os.path.join(ava_tmp_folder, url2.split('/')[-1])
-    ava_main_path = os.path.join(ava_main_folder, url2.split('/')[-1])
-
-    if ava_tmp_path.split('.')[-1] not in ['png', 'jpg', 'jpeg']:
-        return "File extension needs to be either png, jpg or jpeg", False
-
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                with open(ava_tmp_path, 'wb') as fd:
-                    async for data in r.content.iter_chunked(1024):
-                        fd.write(data)
-    except Exception as ex:
-        return ex, False
-
+def _check_and_store_avatar(ava_tmp_path, ava_main_path, name):
+    """The blocking part of verify_and_save_avatar, checks the image size and moves it in place"""
     try:
         pic = Image.open(ava_tmp_path)
         w, h = pic.size
@@ -86,6 +71,26 @@ async def verify_and_save_avatar(url, subfolder, name):
             pass
 
 
+async def verify_and_save_avatar(url, subfolder, name):
+    ava_tmp_folder = f'tmp/pr_avatars/{subfolder}'
+    ava_main_folder = f'data/pr_avatars/{subfolder}'
+    os.makedirs(ava_tmp_folder, exist_ok=True)
+    os.makedirs(ava_main_folder, exist_ok=True)
+    url2 = url.split('?')[::-1][-1]
+    ava_tmp_path = os.path.join(ava_tmp_folder, url2.split('/')[-1])
+    ava_main_path = os.path.join(ava_main_folder, url2.split('/')[-1])
+
+    if ava_tmp_path.split('.')[-1] not in ['png', 'jpg', 'jpeg']:
+        return "File extension needs to be either png, jpg or jpeg", False
+
+    try:
+        await http.download(url, ava_tmp_path)
+    except Exception as ex:
+        return ex, False
+
+    return await get_pool('fs').run(_check_and_store_avatar, ava_tmp_path, ava_main_path, name)
+
+
 class PRManager:
     @staticmethod
     async def add_or_update_member(uid, name=None, main_avatar_url=None, pr_specific_avatar=None, specific_pr=None):
@@ -4,29 +4,41 @@ Welcomemsg: id, content, desc, images, title, FK_GUILD
 Logging: id, target_ch, type, FK_GUILD, FK_Hooks
 Webhooks: id, url, id, target_ch, FK_GUILD, valid
 """
+import asyncio
 import json
 import logging
 import os
+import time
 from datetime import datetime
 
-import aiohttp
 import discord
 from peewee import *
 
-from utils.dataIOa import dataIOa
+from utils.censor import get_censor_matcher
+from utils.config import config
+from utils.database import get_db, get_table_function, run_db
+from utils.http import http
 
 logger = logging.getLogger('info')
 error_logger = logging.getLogger('error')
 
 DB = "data/serversetup.db"
-db = SqliteDatabase(DB, pragmas={'foreign_keys': 1})
+db = get_db(DB)
 
-clr = dataIOa.load_json('config.json')['BOT_DEFAULT_EMBED_COLOR_STR'][-6:]
+# max concurrent fetch_channel/fetch_webhook calls while hydrating bot.from_serversetup
+FETCH_CONCURRENCY = 10
+# gid -> ms it took to hydrate that guild on the last get_setup_formatted
+hydration_timings = {}
+# fetched webhook objects are reused for this long (seconds) before they're fetched again
+HOOK_TTL = 3600
+_hook_cache = {}  # hook id -> (webhook, fetched at)
+_loaded_at = {}  # gid -> when its setup was last hydrated
 
 
 class BaseModel(Model):
     class Meta:
         database = db
+        table_function = get_table_function(DB)
 
 
 class Guild(BaseModel):
@@ -44,7 +56,7 @@ class WelcomeMsg(BaseModel):
     desc = CharField(default='')
     images = CharField(default='')
     title = CharField(default='')
-    color = IntegerField(default=int(f"0x{clr}", 16))
+    color = IntegerField(default=config.embed_color)
     target_ch = IntegerField()  # target channel
     backup_hook = IntegerField()  # target channel
     display_mem_count = BooleanField(default=True)
@@ -205,64 +217,148 @@ class SSManager:
         except:
             Webhook.insert(type=typ, guild=g, target_ch=tar_id, url=h_url, hook_id=hook_id).execute()
 
+    @staticmethod
+    def _load_setup_rows(gid=None):
+        gs = [q for q in (Guild.select().where(Guild.id == gid) if gid else Guild.select()).dicts()]
+        if gid:
+            return gs, {gid: {'logging': [q for q in Logging.select().where(Logging.guild == gid).dicts()],
+                              'hooks': [q for q in Webhook.select().where(Webhook.guild == gid).dicts()],
+                              'welcs': [q for q in WelcomeMsg.select().where(WelcomeMsg.guild == gid).dicts()]}}
+        by_guild = {g['id']: {'logging': [], 'hooks': [], 'welcs': []} for g in gs}
+        # one pass over each table instead of one per guild
+        for lg in Logging.select().dicts():
+            if lg['guild'] in by_guild: by_guild[lg['guild']]['logging'].append(lg)
+        for wh in Webhook.select().dicts():
+            if wh['guild'] in by_guild: by_guild[wh['guild']]['hooks'].append(wh)
+        for wel in WelcomeMsg.select().dicts():
+            if wel['guild'] in by_guild: by_guild[wel['guild']]['welcs'].append(wel)
+        return gs, by_guild
+
+    @staticmethod
+    async def _resolve_channel(bot, ch_id, sem):
+        if not ch_id: return None
+        ch = bot.get_channel(ch_id)
+        if ch: return ch
+        async with sem:
+            return await bot.fetch_channel(ch_id)
+
+    @staticmethod
+    async def _resolve_webhook(bot, hook_id, sem):
+        if not hook_id: return None
+        cached = _hook_cache.get(hook_id)
+        if cached and time.monotonic() - cached[1] < HOOK_TTL: return cached[0]
+        async with sem:
+            hook = await bot.fetch_webhook(hook_id)
+        _hook_cache[hook_id] = (hook, time.monotonic())
+        return hook
+
+    @staticmethod
+    async def _hydrate_guild(bot, g, rows, sem):
+        ret = {'muterole': g['muterole'],
+               'modrole': g['modrole'],
+               # only one is stored for now, checks work with any number of them
+               'modroles': frozenset([g['modrole']] if g['modrole'] else []),
+               'ignored_chs_at_log': g['ignored_chs_at_log'],
+               'censor_list': [c for c in g['censor_list'].split('|!|') if c],
+               'disabled_onlyEnabled_cmds_and_chs': json.loads(g['disabled_onlyEnabled_cmds_and_chs'])}
+        ret['censor_matcher'] = get_censor_matcher(ret['censor_list'])
+
+        lgs, whks = rows['logging'], rows['hooks']
+        res = await asyncio.gather(*[SSManager._resolve_channel(bot, lg['target_ch'], sem) for lg in lgs],
+                                   *[SSManager._resolve_webhook(bot, wh['hook_id'], sem) for wh in whks],
+                                   return_exceptions=True)
+        for lg, ch in zip(lgs, res[:len(lgs)]):
+            ret[lg['type']] = None if isinstance(ch, BaseException) else ch
+        for wh, hook in zip(whks, res[len(lgs):]):
+            if isinstance(hook, BaseException):
+                error_logger.error(f"Webhook for guild {wh['guild']} missing")
+                hook = None
+            ret[f"hook_{wh['type']}"] = hook
+
+        for wel in rows['welcs']:
+            ret['welcomemsg'] = None
+            if not wel['content'] and not wel['desc'] and not wel['images'] and not wel['title']:
+                continue
+            ch, hook = await asyncio.gather(SSManager._resolve_channel(bot, wel['target_ch'], sem),
+                                            SSManager._resolve_webhook(bot, wel['backup_hook'], sem),
+                                            return_exceptions=True)
+            if not ch or isinstance(ch, BaseException):
+                continue
+            wel['target_ch'] = ch
+            wel['backup_hook'] = None if isinstance(hook, BaseException) else hook
+            ret['welcomemsg'] = wel
+        return ret
+
     @staticmethod
     async def get_setup_formatted(bot):
-        gs = [q for q in Guild.select().dicts()]
-        lgs = [q for q in Logging.select().dicts()]
-        whks = [q for q in Webhook.select().dicts()]
-        welcs = [q for q in WelcomeMsg.select().dicts()]
-
-        ret = {}
-        for g in gs:
-            ret[g['id']] = {'muterole': g['muterole'],
-                            'modrole': g['modrole'],
-                            'ignored_chs_at_log': g['ignored_chs_at_log'],
-                            'censor_list': g['censor_list'].split('|!|'),
-                            'disabled_onlyEnabled_cmds_and_chs':
-                                json.loads(g['disabled_onlyEnabled_cmds_and_chs'])}
+        """
+        Builds bot.from_serversetup, all guilds are hydrated concurrently, channels come from the
+        gateway cache when possible and at most FETCH_CONCURRENCY REST fetches run at once
+        """
+        start = time.perf_counter()
+        gs, by_guild = await run_db(db, SSManager._load_setup_rows)
+        sem = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+        async def timed(g):
+            t = time.perf_counter()
             try:
-                ret[g['id']]['censor_list'].remove('')
-            except:
-                pass
-            for lg in lgs:
-                if lg['guild'] != g['id']: continue
-                try:
-                    ret[g['id']][lg['type']] = await bot.fetch_channel(lg['target_ch'])
-                except:
-                    ret[g['id']][lg['type']] = None
-            for wh in whks:
-                if wh['guild'] != g['id']: continue
-                try:
-                    aa = await bot.fetch_webhook(wh['hook_id'])  # wh['hook_id']
-                    ret[g['id']][f"hook_{wh['type']}"] = aa
-                except:
-                    error_logger.error(f"Webhook for guild {wh['guild']} missing")
-                    ret[g['id']][f"hook_{wh['type']}"] = None
-            for wel in welcs:
-                if wel['guild'] != g['id']: continue
-                ret[g['id']]['welcomemsg'] = wel
-                try:
-                    ret[g['id']]['welcomemsg']['target_ch'] = \
-                        await bot.fetch_channel(ret[g['id']]['welcomemsg']['target_ch'])
-                except:
-                    ret[g['id']]['welcomemsg'] = None
-                try:
-                    ret[g['id']]['welcomemsg']['backup_hook'] = \
-                        await bot.fetch_webhook(ret[g['id']]['welcomemsg']['backup_hook'])
-                except:
-                    ret[g['id']]['welcomemsg']['backup_hook'] = None
-                if not wel['content'] and not wel['desc'] and not wel['images'] and not wel['title']:
-                    ret[g['id']]['welcomemsg'] = None
+                return await SSManager._hydrate_guild(bot, g, by_guild[g['id']], sem)
+            finally:
+                hydration_timings[g['id']] = (time.perf_counter() - t) * 1000
+                _loaded_at[g['id']] = time.monotonic()
+
+        hydration_timings.clear()
+        setups = await asyncio.gather(*[timed(g) for g in gs])
+        ret = {g['id']: setup for g, setup in zip(gs, setups)}
+
+        slowest = sorted(hydration_timings.items(), key=lambda x: x[1], reverse=True)[:5]
+        logger.info(f"Serversetup hydrated {len(ret)} guilds in {(time.perf_counter() - start) * 1000:.0f}ms, "
+                    f"slowest: {', '.join(f'{gid} {ms:.0f}ms' for gid, ms in slowest)}")
         return ret
 
+    @staticmethod
+    async def refresh_guild(bot, gid):
+        """
+        Re-hydrate only this guild's entry in bot.from_serversetup
+        :return: the guild's setup, None if it has none
+        """
+        t = time.perf_counter()
+        gs, by_guild = await run_db(db, SSManager._load_setup_rows, gid)
+        setup = None
+        if gs:
+            setup = await SSManager._hydrate_guild(bot, gs[0], by_guild[gid], asyncio.Semaphore(FETCH_CONCURRENCY))
+            bot.from_serversetup[gid] = setup
+        else:
+            bot.from_serversetup.pop(gid, None)
+        hydration_timings[gid] = (time.perf_counter() - t) * 1000
+        _loaded_at[gid] = time.monotonic()
+        return setup
+
+    @staticmethod
+    def invalidate_guild(bot, gid):
+        """Forget the guild's webhooks so the next refresh fetches them again"""
+        sup = bot.from_serversetup.get(gid) or {}
+        hooks = [v for v in sup.values() if isinstance(v, discord.Webhook)]
+        if sup.get('welcomemsg') and sup['welcomemsg'].get('backup_hook'):
+            hooks.append(sup['welcomemsg']['backup_hook'])
+        for h in hooks:
+            _hook_cache.pop(getattr(h, 'id', None), None)
+        _loaded_at.pop(gid, None)
+
+    @staticmethod
+    async def get_guild_setup(bot, gid):
+        """
+        The guild's setup, hydrated on first use
+        :return: setup dict or None if the guild has no setup
+        """
+        if gid not in _loaded_at:
+            return await SSManager.refresh_guild(bot, gid)
+        return bot.from_serversetup.get(gid)
+
 
 async def saveFile(link, path, fName):
     fileName = f"{path}/{fName}"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(link) as r:
-            with open(fileName, 'wb') as fd:
-                async for data in r.content.iter_chunked(1024):
-                    fd.write(data)
+    await http.download(link, fileName)
     return fileName
 
 
@@ -273,8 +369,5 @@ def bot_pfx(bot, _message):
     if there is none use something that has the guild in it under .guild
     :return: prefix
     """
-    prefix = bot.config['BOT_PREFIX']
-    if hasattr(_message, 'channel') and isinstance(_message.channel, discord.DMChannel): return prefix
-    gid = str(_message.guild.id)
-    if gid not in bot.config['B_PREF_GUILD']: return prefix
-    return bot.config['B_PREF_GUILD'][gid]
+    if hasattr(_message, 'channel') and isinstance(_message.channel, discord.DMChannel): return config.prefix
+    return config.prefix_for(_message.guild.id)
@@ -2,13 +2,16 @@ import datetime
 
 from peewee import *
 
+from utils.database import get_db, get_table_function
+
 DB = "data/sticky_messages.db"
-db = SqliteDatabase(DB, pragmas={'foreign_keys': 1})
+db = get_db(DB)
 
 
 class BaseModel(Model):
     class Meta:
         database = db
+        table_function = get_table_function(DB)
 
 
 class StickyMsg(BaseModel):
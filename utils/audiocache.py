@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.config import config
+from utils.dataIOa import dataIOa
+
+logger = logging.getLogger('info')
+error_logger = logging.getLogger('error')
+
+CACHE_DIR = "data/audio_cache"
+INDEX_JSON = f"{CACHE_DIR}/index.json"
+MAX_BYTES = config.get_int('MUSIC_CACHE_MB', 2048) * 1024 * 1024
+
+
+def cache_key(info):
+    """:param info: yt-dlp info dict of a single video"""
+    return f"{info.get('extractor_key') or info.get('ie_key') or 'generic'}_{info['id']}"
+
+
+class AudioCacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+
+class AudioCache:
+    """
+    Downloaded songs shared by every guild, keyed by extractor + video id
+
+    The index (data/audio_cache/index.json) keeps size, last use and metadata (duration,
+    loudness gain...) per song. Songs that are queued somewhere are referenced (acquire/release)
+    and never evicted, the rest are evicted least recently used first once over MAX_BYTES.
+    Every method is thread safe, downloads call them from executor threads.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'index.json')
+        self.max_bytes = max_bytes
+        self.refs = {}
+        self.downloads = {}  # key -> [lock, number of threads using it]
+        self.stats = AudioCacheStats()
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self.index = dataIOa.load_json(self.index_path) if os.path.exists(self.index_path) else {}
+        # drop entries whose files were deleted by hand
+        missing = [k for k, v in self.index.items() if not os.path.exists(v['path'])]
+        for key in missing:
+            del self.index[key]
+        if missing: self._save()
+
+    @property
+    def outtmpl(self):
+        """yt-dlp output template that names files by their cache key"""
+        return f"{self.directory}/%(extractor_key)s_%(id)s.%(ext)s"
+
+    def _save(self):
+        dataIOa.mark_dirty(self.index_path, self.index)
+
+    def lookup(self, key, acquire=True):
+        """:return: the cached entry (and takes a reference to it) or None"""
+        with self._lock:
+            entry = self.index.get(key)
+            if entry and not os.path.exists(entry['path']):
+                del self.index[key]
+                entry = None
+            if not entry:
+                self.stats.misses += 1
+                return None
+            self.stats.hits += 1
+            entry['last_used'] = time.time()
+            if acquire: self.acquire(key)
+            self._save()
+            return entry
+
+    def add(self, key, path, acquire=True, **meta):
+        """Register a freshly downloaded file, this may evict others"""
+        with self._lock:
+            entry = {**self.index.get(key, {}), **meta, 'path': path, 'size': os.path.getsize(path),
+                     'last_used': time.time()}
+            self.index[key] = entry
+            if acquire: self.acquire(key)
+            self._evict()
+            self._save()
+            return entry
+
+    @contextmanager
+    def downloading(self, key):
+        """
+        Hold while looking up and downloading key, a second download of the same song
+        waits for the first one and then finds it in the cache
+        """
+        with self._lock:
+            entry = self.downloads.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.downloads[key]
+
+    def set_meta(self, key, **meta):
+        with self._lock:
+            if key in self.index:
+                self.index[key].update(meta)
+                self._save()
+
+    def get_meta(self, key, name, default=None):
+        with self._lock:
+            return self.index.get(key, {}).get(name, default)
+
+    def acquire(self, key):
+        with self._lock:
+            self.refs[key] = self.refs.get(key, 0) + 1
+
+    def release(self, key):
+        with self._lock:
+            if key not in self.refs: return
+            self.refs[key] -= 1
+            if self.refs[key] <= 0:
+                del self.refs[key]
+            self._evict()
+
+    def total_bytes(self):
+        return sum(e['size'] for e in self.index.values())
+
+    def _evict(self):
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        for key, entry in sorted(self.index.items(), key=lambda e: e[1]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if self.refs.get(key):
+                continue
+            try:
+                os.remove(entry['path'])
+            except FileNotFoundError:
+                pass
+            except OSError as ex:
+                # probably still open somewhere, try again on the next eviction
+                error_logger.error(f"Audio cache: couldn't evict {entry['path']}: {ex}")
+                continue
+            del self.index[key]
+            total -= entry['size']
+            self.stats.evictions += 1
+            self.stats.evicted_bytes += entry['size']
+        self._save()
+
+    def format(self):
+        s = self.stats
+        lookups = s.hits + s.misses
+        ratio = f'{s.hits / lookups * 100:.1f}%' if lookups else '-'
+        return f'songs={len(self.index)} size={self.total_bytes() / 1024 / 1024:.1f}/' \
+               f'{self.max_bytes / 1024 / 1024:.0f}MB in use={len(self.refs)}\n' \
+               f'hits={s.hits} misses={s.misses} ({ratio}) evictions={s.evictions} ' \
+               f'({s.evicted_bytes / 1024 / 1024:.1f}MB)'
@@ -0,0 +1,255 @@
+import asyncio
+import atexit
+import datetime
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+from models.bot import db as bot_db
+from models.moderation import Blacklist
+from models.moderation import db as moderation_db
+from utils.database import run_db
+
+logger = logging.getLogger('info')
+error_logger = logging.getLogger('error')
+
+# pending changes are written at most every FLUSH_INTERVAL seconds
+FLUSH_INTERVAL = 2.0
+
+_stores = []
+
+
+class _WriteBehindStore(ABC):
+    """
+    Base for the in-memory lists, changes are applied to memory right away and
+    queued as {key: row or None (delete)}, the last change of a key wins
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.loaded = False
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._load_lock = None
+        self._task = None
+        _stores.append(self)
+
+    @abstractmethod
+    def _load(self):
+        """Runs on the db thread, returns whatever _set_loaded expects"""
+
+    @abstractmethod
+    def _set_loaded(self, data):
+        pass
+
+    @abstractmethod
+    def _apply(self, changes):
+        """Runs on the db thread, writes {key: row or None}"""
+
+    async def ensure_loaded(self):
+        if self.loaded: return
+        if self._load_lock is None: self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if self.loaded: return
+            self._set_loaded(await run_db(self.db, self._load))
+            self.loaded = True
+
+    def _mark(self, key, row):
+        with self._pending_lock:
+            self._pending[key] = row
+        if self._task is None or self._task.done():
+            try:
+                self._task = asyncio.get_running_loop().create_task(self._run())
+            except RuntimeError:
+                pass  # no loop (exiting), flush_sync picks it up
+
+    def _take_pending(self):
+        with self._pending_lock:
+            changes = self._pending
+            self._pending = {}
+        return changes
+
+    def _requeue(self, changes):
+        with self._pending_lock:
+            # newer changes of the same key win over the failed ones
+            self._pending = {**changes, **self._pending}
+
+    async def _run(self):
+        await asyncio.sleep(FLUSH_INTERVAL)
+        await self.flush()
+
+    async def flush(self):
+        changes = self._take_pending()
+        if not changes: return
+        try:
+            await run_db(self.db, self._apply_atomic, changes)
+        except:
+            self._requeue(changes)
+            error_logger.error(f'{type(self).__name__}: failed writing {len(changes)} changes, retrying later')
+
+    def flush_sync(self):
+        """Write pending changes from the calling thread, for exiting"""
+        changes = self._take_pending()
+        if not changes: return
+        try:
+            self._apply_atomic(changes)
+        except:
+            error_logger.error(f'{type(self).__name__}: lost {len(changes)} changes on exit')
+
+    def _apply_atomic(self, changes):
+        with self.db.atomic():
+            self._apply(changes)
+
+
+class BotUserList(_WriteBehindStore):
+    """
+    Users blacklisted/banned from the whole bot, {user id: meta}
+    Behaves like a read only dict, change it with `add`/`remove`
+    """
+
+    def __init__(self, model):
+        super().__init__(bot_db)
+        self.model = model
+        self.entries = {}
+
+    def _load(self):
+        return [(q['user'], q['meta']) for q in self.model.select(self.model.user, self.model.meta).dicts()]
+
+    def _set_loaded(self, data):
+        # anything added before the load finished is newer than the db
+        self.entries = {**dict(data), **self.entries}
+
+    def __contains__(self, user_id):
+        return user_id in self.entries
+
+    def __getitem__(self, user_id):
+        return self.entries[user_id]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def items(self):
+        return self.entries.items()
+
+    def add(self, user_id, gid, meta):
+        self.entries[user_id] = meta
+        self._mark(user_id, {'user': user_id, 'guild': gid, 'meta': meta, 'when': datetime.datetime.utcnow()})
+
+    def remove(self, user_id):
+        """:return: False if the user wasn't on the list"""
+        if user_id not in self.entries:
+            return False
+        del self.entries[user_id]
+        self._mark(user_id, None)
+        return True
+
+    def _apply(self, changes):
+        removed = [k for k, v in changes.items() if v is None]
+        rows = [v for v in changes.values() if v is not None]
+        if removed:
+            self.model.delete().where(self.model.user << removed).execute()
+        if rows:
+            self.model.insert_many(rows).on_conflict_replace().execute()
+
+    def export(self):
+        return dict(self.entries)
+
+    def import_entries(self, entries, gid=0):
+        """:param entries: {user id: meta}"""
+        for user_id, meta in entries.items():
+            self.add(int(user_id), gid, meta)
+
+
+class GuildBlacklist(_WriteBehindStore):
+    """
+    Per guild moderation blacklist (users that get banned on join), {guild id: set of user ids}
+    """
+
+    def __init__(self):
+        super().__init__(moderation_db)
+        self.guilds = {}
+
+    def _load(self):
+        return [(q['guild'], int(q['user_id'])) for q in Blacklist.select(Blacklist.guild, Blacklist.user_id).dicts()]
+
+    def _set_loaded(self, data):
+        loaded = {}
+        for gid, uid in data:
+            loaded.setdefault(gid, set()).add(uid)
+        # keep changes made while loading
+        with self._pending_lock:
+            pending = dict(self._pending)
+        for (gid, uid), row in pending.items():
+            if row is None:
+                loaded.get(gid, set()).discard(uid)
+            else:
+                loaded.setdefault(gid, set()).add(uid)
+        self.guilds = loaded
+
+    def contains(self, gid, user_id):
+        return user_id in self.guilds.get(gid, ())
+
+    def get(self, gid):
+        return self.guilds.get(gid, set())
+
+    def add(self, gid, user_ids):
+        """:return: set of ids that weren't blacklisted before"""
+        current = self.guilds.setdefault(gid, set())
+        added = set(user_ids) - current
+        current.update(added)
+        for uid in added:
+            self._mark((gid, uid), {'guild': gid, 'user_id': uid})
+        return added
+
+    def remove(self, gid, user_ids):
+        """:return: set of ids that were removed"""
+        current = self.guilds.get(gid, set())
+        removed = current & set(user_ids)
+        current.difference_update(removed)
+        for uid in removed:
+            self._mark((gid, uid), None)
+        if not current: self.guilds.pop(gid, None)
+        return removed
+
+    def _apply(self, changes):
+        by_guild = {}
+        for (gid, uid), row in changes.items():
+            by_guild.setdefault(gid, []).append(uid)
+        for gid, uids in by_guild.items():
+            # the table has no unique index, so every change starts with a delete to not duplicate rows
+            for i in range(0, len(uids), 500):
+                Blacklist.delete().where(Blacklist.guild == gid, Blacklist.user_id << uids[i:i + 500]).execute()
+        rows = [row for row in changes.values() if row is not None]
+        for i in range(0, len(rows), 500):
+            Blacklist.insert_many(rows[i:i + 500]).execute()
+
+    def export(self, gid=None):
+        """:return: {guild id: sorted list of user ids}, only the one guild if gid is given"""
+        if gid is not None:
+            return {gid: sorted(self.get(gid))}
+        return {g: sorted(u) for g, u in self.guilds.items()}
+
+    def import_ids(self, gid, user_ids, replace=False):
+        """
+        :param replace: drop the guild's ids that aren't in user_ids
+        :return: (added, removed) sets
+        """
+        user_ids = {int(u) for u in user_ids}
+        removed = self.remove(gid, self.get(gid) - user_ids) if replace else set()
+        return self.add(gid, user_ids), removed
+
+
+def flush_all_sync():
+    for store in _stores:
+        store.flush_sync()
+
+
+async def flush_all():
+    for store in _stores:
+        await store.flush()
+
+
+atexit.register(flush_all_sync)
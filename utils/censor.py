@@ -0,0 +1,47 @@
+import re
+from functools import lru_cache
+
+
+class CensorMatcher:
+    """Compiled censor list for a single guild.
+
+    Whole word hits are answered by a frozenset lookup, everything else
+    by one alternation regex instead of scanning every term per message."""
+
+    def __init__(self, terms):
+        self.terms = tuple(t.lower() for t in terms)
+        self.words = frozenset(self.terms)
+        self.pattern = None
+        if self.terms:
+            # longest first so the reported term is the most specific one
+            alts = sorted(set(self.terms), key=len, reverse=True)
+            self.pattern = re.compile('|'.join(re.escape(t) for t in alts))
+
+    def __bool__(self):
+        return bool(self.terms)
+
+    def match(self, content):
+        """
+        :param content: message content
+        :return: the offending censor term or None
+        """
+        if not self.terms or not content:
+            return None
+        content = content.lower()
+        for w in content.split():
+            if w in self.words:
+                return w
+        m = self.pattern.search(content)
+        if m:
+            return m.group(0)
+        return None
+
+
+@lru_cache(maxsize=1024)
+def _compile(terms):
+    return CensorMatcher(terms)
+
+
+def get_censor_matcher(terms):
+    """Returns a (cached) matcher for the list, it's only recompiled when the list changes"""
+    return _compile(tuple(t for t in terms if t))
@@ -1,6 +1,46 @@
 from discord import Member
 from discord.ext import commands
 
+# (gid, member id) -> (the guild's mod role set it was computed against, is mod)
+# a refreshed serversetup makes a new set, so those entries stop matching on their own
+_mod_role_cache = {}
+
+
+def get_mod_role_ids(bot, gid):
+    """
+    :return: frozenset of the guild's moderator role ids
+    """
+    sup = bot.from_serversetup.get(gid) if bot.from_serversetup else None
+    if not sup:
+        return frozenset()
+    if 'modroles' not in sup:
+        sup['modroles'] = frozenset([sup['modrole']] if sup.get('modrole') else [])
+    return sup['modroles']
+
+
+def has_mod_role(bot, member, gid):
+    mod_roles = get_mod_role_ids(bot, gid)
+    if not mod_roles:
+        return False
+    key = (gid, member.id)
+    cached = _mod_role_cache.get(key)
+    if cached and cached[0] is mod_roles:
+        return cached[1]
+    ret = any(member.get_role(r) is not None for r in mod_roles) if hasattr(member, 'get_role') else False
+    _mod_role_cache[key] = (mod_roles, ret)
+    return ret
+
+
+def forget_member_roles(gid, uid):
+    """Call when a member's roles change or they leave"""
+    _mod_role_cache.pop((gid, uid), None)
+
+
+def forget_guild_roles(gid):
+    """Call when the bot leaves a guild or one of its roles is deleted"""
+    for key in [k for k in _mod_role_cache if k[0] == gid]:
+        del _mod_role_cache[key]
+
 
 async def owner_check(
         ctx: commands.Context
@@ -75,13 +115,7 @@ async def moderator_check(
     if not ctx.guild:
         return False
     if isinstance(ctx.author, Member) and ctx.author.guild_permissions.administrator: return True
-    if ctx.bot.from_serversetup:
-        if ctx.guild.id in ctx.bot.from_serversetup:
-            if 'modrole' in ctx.bot.from_serversetup[ctx.guild.id]:
-                mr_id = ctx.bot.from_serversetup[ctx.guild.id]['modrole']
-                if mr_id in [r.id for r in ctx.author.roles]:
-                    return True
-    return False
+    return has_mod_role(ctx.bot, ctx.author, ctx.guild.id)
 
 
 # Oshi no ko specific ...
@@ -96,8 +130,7 @@ async def moderator_check_custom(
     if ctx.bot.from_serversetup:
         if ctx.guild.id in ctx.bot.from_serversetup:
             if 'modrole' in ctx.bot.from_serversetup[ctx.guild.id]:
-                mr_id = role_id
-                if mr_id in [r.id for r in ctx.author.roles]:
+                if isinstance(ctx.author, Member) and ctx.author.get_role(role_id):
                     return True
     return False
 
@@ -108,13 +141,7 @@ async def moderator_check_no_ctx(author, guild, bot):
     if not guild:
         return False
     if isinstance(author, Member) and author.guild_permissions.administrator: return True
-    if bot.from_serversetup:
-        if guild.id in bot.from_serversetup:
-            if 'modrole' in bot.from_serversetup[guild.id]:
-                mr_id = bot.from_serversetup[guild.id]['modrole']
-                if mr_id in [r.id for r in author.roles]:
-                    return True
-    return False
+    return has_mod_role(bot, author, guild.id)
 
 
 async def custom_role_is_booster_check(
@@ -122,8 +149,8 @@ async def custom_role_is_booster_check(
 ):
     if str(ctx.guild.id) in ctx.bot.config['BOOSTER_CUSTOM_ROLES_GETTER']:
         return isinstance(ctx.author, Member) and \
-            ctx.bot.config['BOOSTER_CUSTOM_ROLES_GETTER'][str(ctx.guild.id)]['BOOSTER_ROLE_ID'] in \
-            [r.id for r in ctx.author.roles]
+            ctx.author.get_role(ctx.bot.config['BOOSTER_CUSTOM_ROLES_GETTER'][str(ctx.guild.id)]['BOOSTER_ROLE_ID']) \
+            is not None
     return False
 
 
@@ -0,0 +1,118 @@
+import logging
+import threading
+
+from utils.dataIOa import dataIOa
+
+logger = logging.getLogger('info')
+error_logger = logging.getLogger('error')
+
+CONFIG_JSON = 'config.json'
+
+
+class Config:
+    """
+    config.json, parsed once and shared by everything (`bot.config` is the same dict)
+
+    Change values through `set`/`set_guild_prefix` so derived values stay in sync
+    and the file is rewritten atomically.
+    """
+
+    def __init__(self, path=CONFIG_JSON):
+        self.path = path
+        self._data = None
+        self._lock = threading.RLock()
+
+    @property
+    def data(self):
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    self._data = dataIOa.load_json(self.path)
+                    self._derive()
+        return self._data
+
+    def _derive(self):
+        # values that are computed from others and never saved
+        clr = self._data.get('BOT_DEFAULT_EMBED_COLOR_STR', '')[-6:]
+        try:
+            self._data['BOT_DEFAULT_EMBED_COLOR'] = int(f"0x{clr}", 16)
+        except ValueError:
+            self._data['BOT_DEFAULT_EMBED_COLOR'] = 0
+        self._data.setdefault('B_PREF_GUILD', {})
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def get_int(self, key, default=0):
+        try:
+            return int(self.data.get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def get_bool(self, key, default=False):
+        return bool(self.data.get(key, default))
+
+    def get_str(self, key, default=''):
+        val = self.data.get(key, default)
+        return default if val is None else str(val)
+
+    @property
+    def prefix(self):
+        return self.data['BOT_PREFIX']
+
+    @property
+    def guild_prefixes(self):
+        return self.data['B_PREF_GUILD']
+
+    @property
+    def embed_color(self):
+        return self.data['BOT_DEFAULT_EMBED_COLOR']
+
+    def prefix_for(self, gid):
+        """
+        :param gid: guild id or None for dms
+        :return: the guild's prefix, or the global one
+        """
+        if gid is None:
+            return self.data['BOT_PREFIX']
+        return self.data['B_PREF_GUILD'].get(str(gid), self.data['BOT_PREFIX'])
+
+    def set(self, key, value, save=True):
+        self.data[key] = value
+        if key == 'BOT_DEFAULT_EMBED_COLOR_STR':
+            self._derive()
+        if save:
+            return self.save()
+        return True
+
+    def set_guild_prefix(self, gid, prefix, save=True):
+        """Setting a guild's prefix to the global one removes the override"""
+        prefixes = self.data['B_PREF_GUILD']
+        if prefix is None or prefix == self.data['BOT_PREFIX']:
+            prefixes.pop(str(gid), None)
+        else:
+            prefixes[str(gid)] = prefix
+        if save:
+            return self.save()
+        return True
+
+    def _persistable(self):
+        ret = dict(self.data)
+        # runtime state (the dm log webhook object) and derived values aren't saved
+        if 'BOT_DM_LOG' in ret:
+            ret['BOT_DM_LOG'] = {**ret['BOT_DM_LOG'], 'CAN_SEND': 0, 'HOOK': 0}
+        ret['BOT_DEFAULT_EMBED_COLOR'] = 0
+        return ret
+
+    def save(self):
+        with self._lock:
+            return dataIOa.save_json(self.path, self._persistable())
+
+
+config = Config()
@@ -1,6 +1,8 @@
+import atexit
 import logging
 import os
-from json import decoder, dump, load
+import threading
+from json import decoder, dump, dumps, load
 from os import replace
 from os.path import splitext
 from random import randint
@@ -8,33 +10,95 @@ from random import randint
 logger = logging.getLogger('info')
 error_logger = logging.getLogger('error')
 
+# write-behind: dirty documents are written at most every FLUSH_INTERVAL seconds,
+# or sooner once FLUSH_THRESHOLD saves have piled up
+FLUSH_INTERVAL = 5.0
+FLUSH_THRESHOLD = 25
+
+_dirty = {}  # filename -> the live object to write
+_dirty_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_flush_event = threading.Event()
+_flusher = None
+_pending_saves = 0
+
+
+def _write_atomic(filename, data):
+    """Serialize data and swap it in with a rename, the file is never left half written."""
+    try:
+        # dumps only returns valid JSON, so the object itself is the integrity check
+        serialized = dumps(data, indent=4, sort_keys=True, separators=(',', ' : '))
+    except (TypeError, ValueError) as e:
+        error_logger.error("Attempted to write file {} but the data isn't JSON serializable, "
+                           "the original file is unaltered. {}".format(filename, e))
+        return False
+    path, _ = splitext(filename)
+    tmp_file = "{}.{}.tmp".format(path, randint(1000, 9999))
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(serialized)
+        replace(tmp_file, filename)
+    except Exception as e:
+        error_logger.error('A issue has occured saving ' + filename + '.\n'
+                                                                      'Traceback:\n'
+                                                                      '{0} {1}'.format(str(e), e.args))
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        return False
+    return True
+
+
+def _flush_loop():
+    while True:
+        _flush_event.wait(FLUSH_INTERVAL)
+        _flush_event.clear()
+        DataIOa.flush()
+
 
 class DataIOa:
 
     @staticmethod
     def save_json(filename, data):
         """Atomically save a JSON file given a filename and a dictionary."""
-        path, _ = splitext(filename)
-        tmp_file = "{}.{}.tmp".format(path, randint(1000, 9999))
-        with open(tmp_file, 'w', encoding='utf-8') as f:
-            dump(data, f, indent=4, sort_keys=True, separators=(',', ' : '))
-        try:
-            with open(tmp_file, 'r', encoding='utf-8') as f:
-                data = load(f)
-        except decoder.JSONDecodeError:
-            error_logger.error("Attempted to write file {} but JSON "
-                               "integrity check on tmp file has failed. "
-                               "The original file is unaltered."
-                               "".format(filename))
-            return False
-        except Exception as e:
-            error_logger.error('A issue has occured saving ' + filename + '.\n'
-                                                                          'Traceback:\n'
-                                                                          '{0} {1}'.format(str(e), e.args))
-            return False
+        with _dirty_lock:
+            # a direct save supersedes a pending write-behind one
+            _dirty.pop(filename, None)
+        return _write_atomic(filename, data)
 
-        replace(tmp_file, filename)
-        return True
+    @staticmethod
+    def mark_dirty(filename, data):
+        """
+        Write-behind version of save_json for hot paths, returns right away and the
+        file gets written by the background flusher (coalescing repeated saves)
+        :param filename: json file path
+        :param data: the live object, it's serialized at flush time so later changes are included
+        """
+        global _flusher, _pending_saves
+        with _dirty_lock:
+            _dirty[filename] = data
+            _pending_saves += 1
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop, name='json_flusher', daemon=True)
+                _flusher.start()
+            if _pending_saves >= FLUSH_THRESHOLD:
+                _flush_event.set()
+
+    @staticmethod
+    def flush():
+        """Write every dirty document now, call before exiting"""
+        global _pending_saves
+        with _flush_lock:
+            with _dirty_lock:
+                pending = dict(_dirty)
+                _dirty.clear()
+                _pending_saves = 0
+            for filename, data in pending.items():
+                try:
+                    _write_atomic(filename, data)
+                except RuntimeError:
+                    # the event loop changed the object mid-serialization, try again next round
+                    with _dirty_lock:
+                        _dirty.setdefault(filename, data)
 
     @staticmethod
     def load_json(filename):
@@ -113,3 +177,4 @@ class DataIOa:
 
 
 dataIOa = DataIOa()
+atexit.register(DataIOa.flush)
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from peewee import SqliteDatabase
+
+from utils.config import config
+from utils.latency import LatencyHistogram
+
+logger = logging.getLogger('info')
+error_logger = logging.getLogger('error')
+
+# WAL lets readers and the writer work at the same time and NORMAL sync only fsyncs on checkpoints
+PRAGMAS = {
+    'foreign_keys': 1,
+    'journal_mode': 'wal',
+    'synchronous': 1,  # NORMAL
+    'cache_size': -8 * 1024,  # in KiB, so 8 MiB
+    'mmap_size': 64 * 1024 * 1024,
+    'temp_store': 2,  # MEMORY
+}
+
+# optional mode where every model module shares a single database file (see utils/migrations.py)
+CONSOLIDATED_DB = "data/consolidated.db"
+CONSOLIDATED = config.get_bool('DB_CONSOLIDATED')
+
+
+class DBStats(LatencyHistogram):
+    """Latency histogram for one database file"""
+
+    def __init__(self):
+        super().__init__('queries')
+        self.pending = 0
+
+    def summary(self):
+        return f'{super().summary()} pending={self.pending}'
+
+
+_databases = {}
+_executors = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def get_db(path):
+    """
+    Every model module should get its database from here instead of making its own SqliteDatabase
+    :param path: path to the .db file
+    :return: the shared (tuned) SqliteDatabase for that file, in consolidated mode
+    the same database is returned for every path
+    """
+    with _lock:
+        if path not in _databases:
+            real_path = CONSOLIDATED_DB if CONSOLIDATED else path
+            existing = [d for d in _databases.values() if d.database == real_path]
+            if existing:
+                _databases[path] = existing[0]
+            else:
+                os.makedirs(os.path.dirname(real_path) or '.', exist_ok=True)
+                _databases[path] = SqliteDatabase(real_path, pragmas=PRAGMAS)
+        return _databases[path]
+
+
+def get_table_function(path):
+    """
+    Use as `table_function` in a model's Meta, in consolidated mode table names get prefixed
+    with the name of the db file they used to live in (both cmds.db and serversetup.db have a `guild`)
+    """
+    if not CONSOLIDATED:
+        return None
+    prefix = table_prefix(path)
+    return lambda model_class: f'{prefix}_{model_class.__name__.lower()}'
+
+
+def table_prefix(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def get_databases():
+    return dict(_databases)
+
+
+def db_name(db):
+    return os.path.basename(str(db.database))
+
+
+def get_executor(db):
+    """One worker thread per db file, so writes to the same file are serialized off the event loop"""
+    name = db_name(db)
+    with _lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'db_{name}')
+            _stats.setdefault(name, DBStats())
+        return _executors[name]
+
+
+def get_stats():
+    return dict(_stats)
+
+
+async def run_db(db, fn, *args, **kwargs):
+    """
+    Run a (peewee) callable on the db's worker thread and await the result
+    :param db: the peewee database the callable uses
+    :param fn: the callable, ex. `Model.create` or `query.execute`
+    :return: whatever fn returns, exceptions are re-raised
+    """
+    executor = get_executor(db)
+    stats = _stats[db_name(db)]
+    stats.pending += 1
+    failed = False
+    start = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, partial(fn, *args, **kwargs))
+    except:
+        failed = True
+        raise
+    finally:
+        stats.pending -= 1
+        stats.record((time.perf_counter() - start) * 1000, failed)
+
+
+def _maintenance(db, action):
+    if action == 'checkpoint':
+        return db.execute_sql('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+    if action == 'vacuum':
+        return db.execute_sql('VACUUM').fetchone()
+    if action == 'optimize':
+        return db.execute_sql('PRAGMA optimize').fetchone()
+    raise ValueError(f'Unknown maintenance action {action}')
+
+
+async def maintenance(action):
+    """
+    :param action: checkpoint | vacuum | optimize
+    :return: {db file name: result or exception}
+    """
+    ret = {}
+    done = set()
+    for path, db in get_databases().items():
+        if id(db) in done: continue
+        done.add(id(db))
+        try:
+            ret[db_name(db)] = await run_db(db, _maintenance, db, action)
+        except Exception as e:
+            error_logger.error(f'Database {action} failed for {path}: {e}')
+            ret[db_name(db)] = e
+    return ret
+
+
+def shutdown_executors(wait=True):
+    with _lock:
+        for ex in _executors.values():
+            ex.shutdown(wait=wait)
+        _executors.clear()
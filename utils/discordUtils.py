@@ -5,17 +5,21 @@ import os
 import random
 import re
 import traceback
+from functools import partial
 
-import aiohttp
 import discord
 from discord import Embed
 from discord import File
 
 from models.antiraid import ArGuild
-from models.bot import BotBlacklist, BotBanlist
-from models.moderation import (Reminderstbl, Actions)
+from models.moderation import (Reminderstbl, Actions, ModManager)
+from models.moderation import db as moderation_db
 from models.serversetup import SSManager
 from utils.SimplePaginator import SimplePaginator
+from utils.config import config
+from utils.database import run_db
+from utils.http import http
+from utils.logsink import LogSink
 
 logger = logging.getLogger('info')
 error_logger = logging.getLogger('error')
@@ -28,25 +32,16 @@ def bot_pfx(bot, _message):
     if there is none use something that has the guild in it under .guild
     :return: prefix
     """
-    prefix = bot.config['BOT_PREFIX']
-    if hasattr(_message, 'channel') and isinstance(_message.channel, discord.DMChannel): return prefix
-    gid = str(_message.guild.id)
-    if gid not in bot.config['B_PREF_GUILD']: return prefix
-    return bot.config['B_PREF_GUILD'][gid]
+    if hasattr(_message, 'channel') and isinstance(_message.channel, discord.DMChannel): return config.prefix
+    return config.prefix_for(_message.guild.id)
 
 
 def bot_pfx_by_gid(bot, gid):
-    prefix = bot.config['BOT_PREFIX']
-    if str(gid) not in bot.config['B_PREF_GUILD']: return prefix
-    return bot.config['B_PREF_GUILD'][str(gid)]
+    return config.prefix_for(gid)
 
 
 def bot_pfx_by_ctx(ctx):
-    bot = ctx.bot
-    gid = ctx.guild.id
-    prefix = bot.config['BOT_PREFIX']
-    if str(gid) not in bot.config['B_PREF_GUILD']: return prefix
-    return bot.config['B_PREF_GUILD'][str(gid)]
+    return config.prefix_for(ctx.guild.id)
 
 
 def escape_at(content):
@@ -126,17 +121,16 @@ async def print_hastebin_or_file(ctx, result, just_file=True):
         if not just_file:
             try:
                 m = await ctx.send('Trying to upload to hastebin, this might take a bit')
-                async with aiohttp.ClientSession() as session:
-                    async with session.post("https://hastebin.com/documents", data=str(result).encode('utf-8')) as resp:
-                        if resp.status == 200:
-                            haste_out = await resp.json()
-                            url = "https://hastebin.com/" + haste_out["key"]
-                            result = 'Large output. Posted to Hastebin: %s' % url
-                            await m.delete()
-                            return await ctx.send(result)
-                        else:
-                            await m.delete()
-                            raise
+                async with http.post("https://hastebin.com/documents", data=str(result).encode('utf-8')) as resp:
+                    if resp.status == 200:
+                        haste_out = await resp.json()
+                        url = "https://hastebin.com/" + haste_out["key"]
+                        result = 'Large output. Posted to Hastebin: %s' % url
+                        await m.delete()
+                        return await ctx.send(result)
+                    else:
+                        await m.delete()
+                        raise
             except:
                 haste_failed = True
         if haste_failed or just_file:
@@ -208,11 +202,7 @@ async def send_and_maybe_paginate_embeds(ctx, embeds):
 
 async def saveFile(link, path, fName):
     fileName = f"{path}/{fName}"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(link) as r:
-            with open(fileName, 'wb') as fd:
-                async for data in r.content.iter_chunked(1024):
-                    fd.write(data)
+    await http.download(link, fileName)
     return fileName
 
 
@@ -332,15 +322,22 @@ async def prompt_custom(ctx, message, *, emotes=None, timeout=60.0, delete_after
         return confirm
 
 
-async def try_send_hook(guild, bot, hook, regular_ch, embed, content=None, log_logMismatch=True):
+async def try_send_hook(guild, bot, hook, regular_ch, embed=None, content=None, log_logMismatch=True, wait=False,
+                        embeds=None):
+    """
+    :param wait: wait for the hook message so it can be returned (needed if you want its id)
+    :param embeds: list of up to 10 embeds to send instead of the single embed
+    :return: the sent message, None if the hook was used without wait
+    """
+    emb = {'embeds': embeds} if embeds else {'embed': embed}
     hook_ok = False
     if hasattr(hook, 'channel_id'):
         hook_ok = regular_ch.id == hook.channel_id
     if hook and hook_ok:
         try:
-            await hook.send(embed=embed, content=content)
+            return await hook.send(content=content, wait=wait, **emb)
         except:
-            return await regular_ch.send(embed=embed, content=content)
+            return await regular_ch.send(content=content, **emb)
     else:
         if not hook_ok:
             if log_logMismatch:
@@ -352,7 +349,7 @@ async def try_send_hook(guild, bot, hook, regular_ch, embed, content=None, log_l
                 error_logger.error(f"**Logging hook and channel id mismatch, please fix!!! on: {guild} (id: "
                                    f"{guild.id})**")
                 content = f"{'' if not content else content}\n\n{warn}"
-        return await regular_ch.send(embed=embed, content=content)
+        return await regular_ch.send(content=content, **emb)
 
 
 async def dm_log_try_setup(bot):
@@ -758,12 +755,10 @@ async def moderation_action(ctx, reason, action_type, offender, no_dm=False,
             resp = actually_resp
         else:
             resp = ctx.author
-        ins_id = Actions.insert(guild=guild.id, reason=reason, type=action_type, channel=chan,
-                                jump_url=jump, responsible=resp.id,
-                                offender=offender, user_display_name=disp_n, no_dm=no_dm).execute()
-        case_id = Actions.select().where(Actions.guild == guild.id).count()
-        Actions.update(case_id_on_g=case_id).where(Actions.id == ins_id).execute()
-        return case_id
+
+        return await run_db(moderation_db, ModManager.insert_action, guild.id, reason=reason, type=action_type,
+                            channel=chan, jump_url=jump, responsible=resp.id, offender=offender,
+                            user_display_name=disp_n, no_dm=no_dm)
     except:
         error_logger.error(f"Failed to insert mod action: {jump}")
         return None
@@ -871,26 +866,41 @@ async def post_mod_log_based_on_type(ctx, log_type, act_id, mute_time_str="",
     em.set_footer(text=f"{datetime.datetime.utcnow().strftime('%c')} | "
                        f'Case id: {act_id}')
     now = datetime.datetime.utcnow()
+    msg = None
     if reason.strip() not in ['[selfmute]']:
-        await log(bot, this_embed=em, this_hook_type='modlog', guild=guild)
-    if not bot.from_serversetup:
-        bot.from_serversetup = await SSManager.get_setup_formatted(bot)
-    if guild.id not in bot.from_serversetup: return
-
-    sup = bot.from_serversetup[guild.id]
+        msg = await log(bot, this_embed=em, this_hook_type='modlog', guild=guild, wait=True)
+    sup = await SSManager.get_guild_setup(bot, guild.id)
+    if not sup: return
     if f'modlog' not in sup or not sup[f'modlog']: return
     if f'hook_modlog' not in sup or not sup[f'hook_modlog']: return
     chan = sup['modlog']
     if chan:
-        Actions.update(logged_after=now, logged_in_ch=chan.id
-                       ).where(Actions.case_id_on_g == act_id,
-                               Actions.guild == guild.id).execute()
+        await run_db(moderation_db, Actions.update(logged_after=now, logged_in_ch=chan.id,
+                                                   logged_msg_id=msg.id if msg else None,
+                                                   logged_hook_id=getattr(msg, 'webhook_id', None)
+                                                   ).where(Actions.case_id_on_g == act_id,
+                                                           Actions.guild == guild.id).execute)
+
+
+def get_log_sink(bot):
+    """Embeds sent with log (without wait) are batched through this, see utils/logsink.py"""
+    if not hasattr(bot, 'log_sink'):
+        bot.log_sink = LogSink(partial(_send_log_batch, bot))
+    return bot.log_sink
+
+
+async def _send_log_batch(bot, gid, hook_typ, embeds, content):
+    # resolved at send time, the setup could've changed while the embeds were queued
+    sup = bot.from_serversetup.get(gid, {})
+    if not sup.get(hook_typ) or not sup.get(f'hook_{hook_typ}'): return
+    await try_send_hook(bot.get_guild(gid), bot, hook=sup[f'hook_{hook_typ}'], regular_ch=sup[hook_typ],
+                        embeds=embeds, content=content)
 
 
 async def log(bot, title=None, txt=None, author=None,
               colorr=0x222222, imageUrl='', guild=None, content=None,
               this_embed=None, this_content=None,
-              this_hook_type=None):
+              this_hook_type=None, wait=False):
     """
     :param title:
     :param txt:
@@ -903,15 +913,14 @@ async def log(bot, title=None, txt=None, author=None,
     :param this_content:
     :param this_hook_type: this_hook_type: reg | leavejoin | modlog
     :param bot:
-    :return:
+    :param wait: see try_send_hook, without it embeds are queued in the log sink and sent in batches
+    :return: the sent message (see try_send_hook)
     """
     try:
         hook_typ = 'reg'
         if this_hook_type: hook_typ = this_hook_type
-        if not bot.from_serversetup:
-            bot.from_serversetup = await SSManager.get_setup_formatted(bot)
-        if guild.id not in bot.from_serversetup: return
-        sup = bot.from_serversetup[guild.id]
+        sup = await SSManager.get_guild_setup(bot, guild.id)
+        if not sup: return
 
         if f'{hook_typ}' not in sup or not sup[f'{hook_typ}']: return
         if f'hook_{hook_typ}' not in sup or not sup[f'hook_{hook_typ}']: return
@@ -940,13 +949,17 @@ async def log(bot, title=None, txt=None, author=None,
                     cnt = content
                     i += 1
 
+                if not wait:
+                    return await get_log_sink(bot).put(guild.id, hook_typ, em, cnt)
                 return await try_send_hook(guild, bot, hook=sup[f'hook_{hook_typ}'],
-                                           regular_ch=sup[hook_typ], embed=em, content=cnt)
+                                           regular_ch=sup[hook_typ], embed=em, content=cnt, wait=wait)
         else:
+            if this_embed and not wait:
+                return await get_log_sink(bot).put(guild.id, hook_typ, this_embed, this_content)
             return await try_send_hook(guild, bot,
                                        hook=sup[f'hook_{hook_typ}'],
                                        regular_ch=sup[hook_typ], embed=this_embed,
-                                       content=this_content)
+                                       content=this_content, wait=wait)
 
     except:
         # print(f'---{datetime.datetime.utcnow().strftime("%c")}---')
@@ -957,15 +970,7 @@ async def log(bot, title=None, txt=None, author=None,
 async def ban_from_bot(bot, offender, meta, gid, ch_to_reply_at=None, arl=0):
     if offender.id == bot.config['OWNER_ID']: return
     # print(meta)
-    bot.banlist[offender.id] = meta
-    try:
-        bb = BotBanlist.get(BotBlacklist.user == offender.id)
-        bb.meta = meta
-        bb.when = datetime.datetime.utcnow()
-        bb.guild = gid
-        bb.save()
-    except:
-        BotBanlist.insert(user=offender.id, guild=gid, meta=meta).execute()
+    bot.banlist.add(offender.id, gid, meta)
     if ch_to_reply_at:
         if arl < 2:
             await ch_to_reply_at.send(f'💢 💢 💢 {offender.mention} you have been banned from the bot!')
@@ -974,15 +979,7 @@ async def ban_from_bot(bot, offender, meta, gid, ch_to_reply_at=None, arl=0):
 async def blacklist_from_bot(bot, offender, meta, gid, ch_to_reply_at=None, arl=0):
     if offender.id == bot.config['OWNER_ID']: return
     # print(meta)
-    bot.blacklist[offender.id] = meta
-    try:
-        bb = BotBlacklist.get(BotBlacklist.user == offender.id)
-        bb.meta = meta
-        bb.when = datetime.datetime.utcnow()
-        bb.guild = gid
-        bb.save()
-    except:
-        BotBlacklist.insert(user=offender.id, guild=gid, meta=meta).execute()
+    bot.blacklist.add(offender.id, gid, meta)
     if arl < 2 and ch_to_reply_at:
         await ch_to_reply_at.send(
             f'💢 {offender.mention} you have been blacklisted from the bot '
@@ -1014,11 +1011,7 @@ async def saveFiles(links, savePath='tmp', fName=''):
             if not fName else f'{savePath}/{fName}_{str(datetime.datetime.utcnow().timestamp()).replace(".", "")}' + \
                               '.' + str(urll).split('.')[-1]
         fileNames.append(fileName)
-        async with aiohttp.ClientSession() as session:
-            async with session.get(urll) as r:
-                with open(fileName, 'wb') as fd:
-                    async for data in r.content.iter_chunked(1024):
-                        fd.write(data)
+        await http.download(urll, fileName)
     return fileNames
 
 
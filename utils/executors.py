@@ -0,0 +1,159 @@
+"""
+Named, bounded thread pools for blocking work that isn't database access (that has its own
+per-db threads, see utils/database.py), so a long download or transcode only waits on its own pool
+and never on the default executor other code uses
+
+    network:   yt-dlp extraction/downloads, blocking http libraries
+    transcode: ffmpeg runs and audio analysis, ffmpeg does the actual work in its own process
+               so threads are enough here, the pool size bounds how many run at once
+    fs:        file and image work (PIL)
+
+Sizes can be overridden with "EXECUTOR_SIZES": {"network": 8, ...} in config.json
+"""
+import asyncio
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from utils.config import config
+from utils.latency import LatencyHistogram
+
+logger = logging.getLogger('info')
+error_logger = logging.getLogger('error')
+
+DEFAULT_SIZES = {
+    'network': 8,
+    'transcode': max(1, (os.cpu_count() or 2) // 2),
+    'fs': 4,
+}
+
+
+class PoolStats:
+    def __init__(self):
+        self.submitted = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.max_queued = 0
+        self.wait = LatencyHistogram('calls')  # time spent queued
+        self.run = LatencyHistogram('calls')  # time spent running
+
+    @property
+    def queued(self):
+        return self.submitted - self.completed - self.failed - self.cancelled - self.running
+
+
+class NamedExecutor:
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'pool_{name}')
+        self.stats = PoolStats()
+        self._lock = threading.Lock()
+
+    def _call(self, queued_at, fn):
+        start = time.perf_counter()
+        with self._lock:
+            self.stats.running += 1
+        self.stats.wait.record((start - queued_at) * 1000)
+        failed = False
+        try:
+            return fn()
+        except:
+            failed = True
+            raise
+        finally:
+            with self._lock:
+                self.stats.running -= 1
+                if failed:
+                    self.stats.failed += 1
+                else:
+                    self.stats.completed += 1
+            self.stats.run.record((time.perf_counter() - start) * 1000, failed)
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run fn on this pool and await the result
+        Cancelling the caller drops the call if it didn't start yet
+        """
+        with self._lock:
+            self.stats.submitted += 1
+            self.stats.max_queued = max(self.stats.max_queued, self.stats.queued)
+        cfut = self.executor.submit(self._call, time.perf_counter(), partial(fn, *args, **kwargs))
+        try:
+            return await asyncio.wrap_future(cfut)
+        except asyncio.CancelledError:
+            if cfut.cancel():
+                with self._lock:
+                    self.stats.cancelled += 1
+            raise
+
+    async def run_process(self, args, **popen_kwargs):
+        """
+        Run a command and wait for it on this pool, the process is killed if the caller is cancelled
+        :return: (returncode, stdout, stderr)
+        """
+        state = {'cancelled': False}
+        state_lock = threading.Lock()
+
+        def _run():
+            with subprocess.Popen(args, **popen_kwargs) as process:
+                with state_lock:
+                    state['process'] = process
+                    cancelled = state['cancelled']
+                if cancelled:  # the caller went away while it was starting
+                    process.kill()
+                out, err = process.communicate()
+                return process.returncode, out, err
+
+        try:
+            return await self.run(_run)
+        except asyncio.CancelledError:
+            with state_lock:
+                state['cancelled'] = True
+                process = state.get('process')
+            if process and process.poll() is None:
+                process.kill()
+            raise
+
+    def format(self):
+        s = self.stats
+        return f'{self.name} ({self.max_workers} workers): running={s.running} queued={s.queued} ' \
+               f'(max {s.max_queued}) done={s.completed} failed={s.failed} cancelled={s.cancelled}\n' \
+               f'  wait: {s.wait.format()}\n  run: {s.run.format()}'
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def get_pool(name):
+    """:param name: network | transcode | fs (or any other name, those get 4 workers)"""
+    with _lock:
+        if name not in _pools:
+            sizes = {**DEFAULT_SIZES, **(config.get('EXECUTOR_SIZES') or {})}
+            _pools[name] = NamedExecutor(name, int(sizes.get(name, 4)))
+        return _pools[name]
+
+
+def get_pools():
+    return dict(_pools)
+
+
+def format_pools():
+    return '\n'.join(p.format() for _, p in sorted(_pools.items())) or 'No pool was used yet'
+
+
+def shutdown_pools(wait=True):
+    with _lock:
+        for pool in _pools.values():
+            pool.shutdown(wait=wait)
+        _pools.clear()
@@ -0,0 +1,109 @@
+import logging
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from utils.config import config
+from utils.latency import LatencyHistogram
+
+logger = logging.getLogger('info')
+error_logger = logging.getLogger('error')
+
+# pool sizes and timeouts, can be overridden in config.json
+POOL_LIMIT = config.get_int('HTTP_POOL_LIMIT', 100)
+POOL_LIMIT_PER_HOST = config.get_int('HTTP_POOL_LIMIT_PER_HOST', 10)
+DNS_CACHE_TTL = 300
+TIMEOUT_TOTAL = config.get_int('HTTP_TIMEOUT', 60)
+TIMEOUT_CONNECT = 10
+# downloads can take as long as they need as long as data keeps coming in
+TIMEOUT_DOWNLOAD_READ = config.get_int('HTTP_DOWNLOAD_READ_TIMEOUT', 30)
+# how many hosts get their own latency line in `format`
+TOP_HOSTS = 5
+
+
+class HttpStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.sessions_created = 0
+        self.latency = LatencyHistogram('requests')
+        self.hosts = {}  # host -> request count
+
+
+class HttpClient:
+    """
+    One aiohttp session (and connection pool) shared by the whole bot, so repeated requests
+    to the same host (discord cdn avatars, hastebin...) reuse keep-alive connections
+
+    Usage: `async with http.get(url) as r:`, same as `session.get`
+    """
+
+    def __init__(self):
+        self._session = None
+        self.stats = HttpStats()
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=POOL_LIMIT, limit_per_host=POOL_LIMIT_PER_HOST,
+                                             ttl_dns_cache=DNS_CACHE_TTL)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=TIMEOUT_TOTAL, sock_connect=TIMEOUT_CONNECT))
+            self.stats.sessions_created += 1
+        return self._session
+
+    @asynccontextmanager
+    async def request(self, method, url, **kwargs):
+        host = urlsplit(str(url)).hostname or '?'
+        self.stats.requests += 1
+        self.stats.hosts[host] = self.stats.hosts.get(host, 0) + 1
+        failed = False
+        start = time.perf_counter()
+        try:
+            async with self.session.request(method, url, **kwargs) as resp:
+                yield resp
+        except:
+            failed = True
+            self.stats.errors += 1
+            raise
+        finally:
+            self.stats.latency.record((time.perf_counter() - start) * 1000, failed)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    async def download(self, url, path, chunk_size=1024 * 64):
+        """Stream url into the file at path"""
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=TIMEOUT_CONNECT, sock_read=TIMEOUT_DOWNLOAD_READ)
+        async with self.get(url, timeout=timeout) as r:
+            with open(path, 'wb') as fd:
+                async for data in r.content.iter_chunked(chunk_size):
+                    fd.write(data)
+        return path
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def format(self):
+        s = self.stats
+        pool = ''
+        if self._session and not self._session.closed:
+            conn = self._session.connector
+            in_use = sum(len(v) for v in getattr(conn, '_acquired_per_host', {}).values())
+            idle = sum(len(v) for v in getattr(conn, '_conns', {}).values())
+            pool = f'pool: in use={in_use} idle={idle} limit={conn.limit} per host={conn.limit_per_host}\n'
+        hosts = sorted(s.hosts.items(), key=lambda h: h[1], reverse=True)[:TOP_HOSTS]
+        hosts = ' '.join(f'{h}: {c}' for h, c in hosts)
+        return f'requests={s.requests} errors={s.errors} sessions={s.sessions_created}\n{pool}' \
+               f'top hosts: {hosts or "-"}\nlatency: {s.latency.format()}'
+
+
+http = HttpClient()
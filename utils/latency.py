@@ -0,0 +1,35 @@
+# upper bounds of the latency buckets, in ms (last bucket is everything above)
+LATENCY_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+class LatencyHistogram:
+    """Count, average, max and a bucketed histogram of timings in ms"""
+
+    def __init__(self, label='calls'):
+        """:param label: what is being timed, used in `format` ("No {label} yet")"""
+        self.label = label
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.errors = 0
+
+    def record(self, ms, failed=False):
+        i = 0
+        while i < len(LATENCY_BUCKETS) and ms > LATENCY_BUCKETS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        if failed: self.errors += 1
+
+    def summary(self):
+        return f'n={self.count} avg={self.total_ms / self.count:.2f}ms max={self.max_ms:.2f}ms err={self.errors}'
+
+    def format(self):
+        if not self.count:
+            return f"No {self.label} yet"
+        labels = [f'<={b}ms' for b in LATENCY_BUCKETS] + [f'>{LATENCY_BUCKETS[-1]}ms']
+        hist = ' '.join(f'{l}: {c}' for l, c in zip(labels, self.buckets) if c)
+        return f'{self.summary()}\n{hist}'
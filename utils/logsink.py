@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import discord
+
+from utils.latency import LatencyHistogram
+
+logger = logging.getLogger('info')
+error_logger = logging.getLogger('error')
+
+# discord limits for a single webhook message
+MAX_EMBEDS_PER_SEND = 10
+MAX_EMBED_CHARS_PER_SEND = 6000
+# how often the queues get flushed, in seconds
+FLUSH_INTERVAL = 2.0
+# over this many queued embeds for one hook the caller has to wait for a flush
+HIGH_WATER = 50
+# over this many new embeds are dropped, and a summary of what was dropped is sent instead
+MAX_QUEUE = 200
+# how long shutdown waits for the queues to be sent, in seconds
+CLOSE_TIMEOUT = 10
+
+
+class LogSinkStats:
+    def __init__(self):
+        self.enqueued = 0
+        self.sent_embeds = 0
+        self.sent_msgs = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.flush_latency = LatencyHistogram('flushes')
+
+
+class LogSink:
+    """
+    Buffers log embeds per (guild id, hook type) and sends them in batches of up to 10 embeds per
+    webhook call, so bursts (raids, purges) don't run into rate limits one embed at a time.
+    """
+
+    def __init__(self, send_fnc):
+        """
+        :param send_fnc: async (guild_id, hook_type, embeds, content) -> None, does the actual sending
+        """
+        self.send_fnc = send_fnc
+        self.queues = {}  # (gid, hook_type) -> deque of (embed, content)
+        self.dropped = {}  # (gid, hook_type) -> count since the last flush
+        self.locks = {}
+        self.stats = LogSinkStats()
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def put(self, gid, hook_type, embed, content=None):
+        """
+        Queue an embed for sending
+        :return: False if it was dropped because the queue is full
+        """
+        self.start()
+        key = (gid, hook_type)
+        q = self.queues.setdefault(key, deque())
+        if len(q) >= MAX_QUEUE:
+            self.dropped[key] = self.dropped.get(key, 0) + 1
+            self.stats.dropped += 1
+            return False
+        q.append((embed, content))
+        self.stats.enqueued += 1
+        self.stats.max_depth = max(self.stats.max_depth, len(q))
+        if len(q) >= HIGH_WATER:
+            # backpressure, the producer waits until its hook caught up
+            await self.flush(key)
+        return True
+
+    def depth(self):
+        return sum(len(q) for q in self.queues.values())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            keys = [k for k, q in self.queues.items() if q or self.dropped.get(k)]
+            await asyncio.gather(*[self.flush(k) for k in keys], return_exceptions=True)
+
+    @staticmethod
+    def _next_batch(q):
+        embeds = []
+        content = None
+        chars = 0
+        while q and len(embeds) < MAX_EMBEDS_PER_SEND:
+            embed, cnt = q[0]
+            # only the first message of a batch can bring its content along
+            if cnt and embeds:
+                break
+            if embeds and chars + len(embed) > MAX_EMBED_CHARS_PER_SEND:
+                break
+            q.popleft()
+            embeds.append(embed)
+            chars += len(embed)
+            if cnt: content = cnt
+        return embeds, content
+
+    async def flush(self, key):
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            q = self.queues.get(key)
+            while q:
+                embeds, content = self._next_batch(q)
+                # one retry, after that the batch is counted as dropped
+                if not await self._send(key, embeds, content) and not await self._send(key, embeds, content):
+                    self.stats.dropped += len(embeds)
+            dropped = self.dropped.pop(key, 0)
+            if dropped:
+                em = discord.Embed(title="Logging is overloaded",
+                                   description=f"**{dropped}** log messages were dropped because "
+                                               f"too many events happened at once.", color=0xe62d10)
+                await self._send(key, [em], None)
+            if key in self.queues and not self.queues[key]:
+                del self.queues[key]
+
+    async def flush_all(self):
+        for key in list(self.queues) + list(self.dropped):
+            await self.flush(key)
+
+    async def close(self):
+        """Send whatever is still queued and stop the flush loop, for shutdown"""
+        try:
+            await asyncio.wait_for(self.flush_all(), CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            error_logger.error(f"Log sink: gave up flushing {self.depth()} embeds on shutdown")
+        finally:
+            self.stop()
+
+    async def _send(self, key, embeds, content):
+        """:return: whether it was sent"""
+        start = time.perf_counter()
+        failed = False
+        try:
+            await self.send_fnc(key[0], key[1], embeds, content)
+            self.stats.sent_embeds += len(embeds)
+            self.stats.sent_msgs += 1
+        except:
+            failed = True
+            error_logger.error(f"Log sink failed sending {len(embeds)} embeds for {key}")
+        finally:
+            self.stats.flush_latency.record((time.perf_counter() - start) * 1000, failed)
+        return not failed
+
+    def format(self):
+        s = self.stats
+        return f'queued now={self.depth()} (max per hook {s.max_depth}) enqueued={s.enqueued} ' \
+               f'sent={s.sent_embeds} embeds in {s.sent_msgs} msgs dropped={s.dropped}\n' \
+               f'flush latency: {s.flush_latency.format()}'
@@ -0,0 +1,107 @@
+import hashlib
+import logging
+import math
+import os
+import subprocess
+import threading
+
+import numpy as np
+
+from utils.dataIOa import dataIOa
+
+logger = logging.getLogger('info')
+error_logger = logging.getLogger('error')
+
+LOUDNESS_JSON = "data/music_loudness.json"
+
+# same targets the old volumedetect loop converged to (people can adjust the volume on their own)
+MAX_PEAK_DB = -1.0
+MAX_MEAN_DB = -12.0
+# only the first 6 minutes are analyzed
+ANALYZE_SECONDS = 360
+SAMPLE_RATE = 48000
+CHANNELS = 2
+# bytes of f32 pcm read from ffmpeg at a time (~1s of audio)
+READ_SIZE = SAMPLE_RATE * CHANNELS * 4
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def measure(path):
+    """
+    Decode the file once to f32 pcm and measure it
+    :return: (peak dB, mean dB) like ffmpeg's volumedetect reports them, None for silence
+    """
+    cmd = ['ffmpeg', '-loglevel', 'error', '-t', str(ANALYZE_SECONDS), '-i', path, '-vn', '-map', '0:a:0',
+           '-ac', str(CHANNELS), '-ar', str(SAMPLE_RATE), '-f', 'f32le', '-']
+    peak = 0.0
+    sum_sq = 0.0
+    n = 0
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+        rest = b''
+        while True:
+            chunk = process.stdout.read(READ_SIZE)
+            if not chunk:
+                break
+            chunk = rest + chunk
+            usable = len(chunk) - len(chunk) % 4
+            rest = chunk[usable:]
+            samples = np.frombuffer(chunk[:usable], dtype=np.float32).astype(np.float64)
+            if not samples.size:
+                continue
+            peak = max(peak, float(np.max(np.abs(samples))))
+            sum_sq += float(np.dot(samples, samples))
+            n += samples.size
+        if process.wait() != 0 and not n:
+            raise Exception(f'ffmpeg failed decoding {path}')
+    if not n or peak == 0.0 or sum_sq == 0.0:
+        return None
+    return 20 * math.log10(peak), 10 * math.log10(sum_sq / n)
+
+
+def gain_for(peak_db, mean_db):
+    """The gain (dB) that brings peak and mean at or under the targets, whichever needs more"""
+    return round(min(MAX_PEAK_DB - peak_db, MAX_MEAN_DB - mean_db), 1)
+
+
+class LoudnessCache:
+    """Gain per audio content hash, so the same song is only ever analyzed once"""
+
+    def __init__(self, path=LOUDNESS_JSON):
+        self.path = path
+        self._lock = threading.Lock()
+        self.gains = dataIOa.load_json(path) if os.path.exists(path) else {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_gain(self, audio_path):
+        """
+        Blocking (run it in an executor)
+        :return: gain in dB, None if the file couldn't be analyzed (nothing is cached then)
+        """
+        try:
+            key = file_hash(audio_path)
+        except OSError as ex:
+            error_logger.error(f"Loudness: can't read {audio_path}: {ex}")
+            return None
+        with self._lock:
+            if key in self.gains:
+                self.hits += 1
+                return self.gains[key]
+        self.misses += 1
+        try:
+            measured = measure(audio_path)
+        except Exception as ex:
+            error_logger.error(f"Loudness analysis failed for {audio_path}: {ex}")
+            return None
+        gain = 0 if measured is None else gain_for(*measured)
+        with self._lock:
+            self.gains[key] = gain
+            dataIOa.mark_dirty(self.path, self.gains)
+        return gain
@@ -0,0 +1,146 @@
+"""
+Versioned schema migrations
+
+Model modules register theirs with the `migration` decorator, `run_migrations` (ran once at startup)
+applies every one that hasn't been applied yet, in order, and records it in the schema_version table
+of that database. Migrations have to be safe to re-run in case one fails half way.
+
+With "DB_CONSOLIDATED": true in config.json all model modules share one database file, the first
+start in that mode copies the old per-feature .db files into it. Those files are only read, never
+deleted, so switching the mode back off just goes back to using them.
+"""
+import datetime
+import importlib
+import logging
+import os
+
+from utils.database import CONSOLIDATED, CONSOLIDATED_DB, get_db, table_prefix
+
+logger = logging.getLogger('info')
+error_logger = logging.getLogger('error')
+
+# legacy db file -> model module that owns its tables
+LEGACY_DBS = {
+    "data/afks.db": "models.afking",
+    "data/antiraid.db": "models.antiraid",
+    "data/bot.db": "models.bot",
+    "data/claims.db": "models.claims",
+    "data/cmds.db": "models.cmds",
+    "data/manga.db": "models.manga",
+    "data/moderation.db": "models.moderation",
+    "data/prs.db": "models.partyranks",
+    "data/quick_alerts.db": "models.quickAlerts",
+    "data/rrs.db": "models.reactionroles",
+    "data/serversetup.db": "models.serversetup",
+    "data/sticky_messages.db": "models.sticky_message",
+}
+
+
+def _columns(db, table, schema='main'):
+    return [r[1] for r in db.execute_sql(f'PRAGMA {schema}.table_info("{table}")').fetchall()]
+
+
+def _import_legacy_dbs(db):
+    """Copy the rows of every legacy per-feature db file into the prefixed tables"""
+    for path, module in LEGACY_DBS.items():
+        # importing the module creates its (prefixed) tables in the consolidated db
+        importlib.import_module(module)
+        if not os.path.exists(path):
+            continue
+        prefix = table_prefix(path)
+        # sqlite doesn't allow ATTACH inside a transaction
+        db.execute_sql('ATTACH DATABASE ? AS legacy', (path,))
+        try:
+            with db.atomic():
+                _copy_legacy_tables(db, path, prefix)
+        finally:
+            db.execute_sql('DETACH DATABASE legacy')
+
+
+def _copy_legacy_tables(db, path, prefix):
+    legacy_tables = [r[0] for r in db.execute_sql(
+        "SELECT name FROM legacy.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall()]
+    for table in legacy_tables:
+        target = f'{prefix}_{table}'
+        target_cols = _columns(db, target)
+        if not target_cols:
+            logger.info(f'Migration: no table {target} for {path}:{table}, skipping')
+            continue
+        cols = [c for c in _columns(db, table, 'legacy') if c in target_cols]
+        col_list = ', '.join(f'"{c}"' for c in cols)
+        db.execute_sql(f'INSERT OR IGNORE INTO main."{target}" ({col_list}) '
+                       f'SELECT {col_list} FROM legacy."{table}"')
+        logger.info(f'Migration: copied {path}:{table} into {target}')
+
+
+def add_column(db, table, column, definition):
+    """ALTER TABLE ADD COLUMN that's a no-op if the column is already there (fresh dbs)"""
+    if column in _columns(db, table):
+        return False
+    db.execute_sql(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition}')
+    return True
+
+
+# db path -> [(version, description, function(db))]
+_migrations = {}
+
+
+def migration(path, version, description):
+    """Register a migration for the database at path, versions only have to be unique per path"""
+
+    def decorator(fnc):
+        _migrations.setdefault(path, []).append((version, description, fnc))
+        return fnc
+
+    return decorator
+
+
+if CONSOLIDATED:
+    migration(CONSOLIDATED_DB, 1, 'Import the per-feature db files')(_import_legacy_dbs)
+
+
+def current_version(db, name):
+    db.execute_sql('CREATE TABLE IF NOT EXISTS schema_version '
+                   '(name TEXT, version INTEGER, description TEXT, applied_on TEXT, PRIMARY KEY (name, version))')
+    row = db.execute_sql('SELECT MAX(version) FROM schema_version WHERE name = ?', (name,)).fetchone()
+    return row[0] or 0
+
+
+def _run(path):
+    db = get_db(path)
+    name = table_prefix(path)
+    applied = []
+    version = current_version(db, name)
+    for v, desc, fnc in sorted(_migrations.get(path, []), key=lambda m: m[0]):
+        if v <= version: continue
+        logger.info(f'Migration {name} {v}: {desc}')
+        try:
+            # foreign keys are off so rows can be copied/rebuilt in any table order
+            db.execute_sql('PRAGMA foreign_keys = 0')
+            fnc(db)
+            db.execute_sql('INSERT INTO schema_version (name, version, description, applied_on) VALUES (?, ?, ?, ?)',
+                           (name, v, desc, datetime.datetime.utcnow().isoformat()))
+        except:
+            error_logger.error(f'Migration {name} {v} ({desc}) failed, it will be retried on the next start')
+            raise
+        finally:
+            db.execute_sql('PRAGMA foreign_keys = 1')
+        applied.append(f'{name} {v}')
+    return applied
+
+
+def run_migrations():
+    """
+    Bring every database up to its latest version
+    :return: list of applied migrations
+    """
+    for module in LEGACY_DBS.values():
+        # makes sure every model module had the chance to register its migrations
+        importlib.import_module(module)
+    applied = []
+    if CONSOLIDATED:
+        applied.extend(_run(CONSOLIDATED_DB))
+    for path in list(_migrations):
+        if path == CONSOLIDATED_DB: continue
+        applied.extend(_run(path))
+    return applied